@@ -0,0 +1,1054 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for the hot paths between fetching the calendar and pushing the frame to the E-Ink display. None of
+these need the actual panel to be connected, so they can be run on a PC to compare changes before copying them over
+to the RPi. Run "python3 benchmark.py -h" for the list of available benchmarks.
+"""
+
+import argparse
+import datetime
+import http.server
+import json
+import logging
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import types
+import urllib.parse
+
+
+def timeit(func, repeat):
+    # returns the best wall time of the given number of runs, along with the result of the last run
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def legacy_packbuffer(buf_7color, width, height):
+    # original pure-Python packing loop of EPD.getbuffer, kept here as the reference implementation
+    buf = [0x00] * int(width * height / 2)
+    idx = 0
+    for i in range(0, len(buf_7color), 2):
+        buf[idx] = (buf_7color[i] << 4) + buf_7color[i+1]
+        idx += 1
+    return buf
+
+
+def legacy_transfer(epdconfig, image, width, height):
+    # original row-by-row transfer loop of EPD.display, kept here as the reference implementation
+    Width = int(width / 4)
+    Width1 = int(width / 2)
+    for i in range(height):
+        epdconfig.spi_writebyte2(image[i * Width1: i * Width1 + Width], Width)
+    for i in range(height):
+        epdconfig.spi_writebyte2(image[i * Width1 + Width: i * Width1 + Width1], Width)
+
+
+def random_frame(width, height, seed=0):
+    # a quantized frame of random panel colors, one byte per pixel
+    rng = random.Random(seed)
+    return bytes(rng.choice((0, 1, 2, 3, 5, 6)) for _ in range(width * height))
+
+
+def sample_image(width, height):
+    # a calendar-like full-color image: anti-aliased text, solid boxes and a gradient strip
+    from PIL import Image, ImageDraw, ImageFont
+
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.truetype('render/font/Lexend-Regular.ttf', 28)
+    rng = random.Random(0)
+    for y in range(0, height - 200, 40):
+        color = rng.choice(('black', 'black', 'red', 'blue', '#6c757d'))
+        draw.text((20, y), 'Event {} - Team sync, dentist, pick up groceries'.format(y), fill=color, font=font)
+    for _ in range(20):
+        x, y = rng.randrange(width - 100), rng.randrange(height - 100)
+        draw.rectangle((x, y, x + 80, y + 80), fill=rng.choice(('yellow', 'green', 'red', 'blue')))
+    for x in range(width):
+        draw.line((x, height - 200, x, height), fill=(x * 255 // width, 128, 255 - x * 255 // width))
+    return image
+
+
+def legacy_quantize(image):
+    # original palette construction and quantization of EPD.getbuffer, kept here as the reference implementation
+    from PIL import Image
+
+    pal_image = Image.new("P", (1,1))
+    pal_image.putpalette( (0,0,0,  255,255,255,  255,255,0,  255,0,0,  0,0,0,  0,0,255,  0,255,0) + (0,0,0)*249)
+    return image.convert("RGB").quantize(palette=pal_image).tobytes('raw')
+
+
+def legacy_month_html(render_service, cal_dict, cal_list, month_name, batt_text):
+    # original template loading and string concatenation of RenderHelper.generateMonthCal, kept here as the reference
+    max_events_per_day = cal_dict['maxEventsPerDay']
+    day_of_week_text = cal_dict['dayOfWeekText']
+    week_start_day = cal_dict['weekStartDay']
+    is24hour = cal_dict['is24hour']
+
+    with open(render_service.currPath + '/calendar_template.html', 'r') as file:
+        calendar_template = file.read()
+
+    cal_days_of_week = ''
+    for i in range(0, 7):
+        cal_days_of_week += '<li class="font-weight-bold text-uppercase">' + day_of_week_text[
+            (i + week_start_day) % 7] + "</li>\n"
+
+    cal_events_text = ''
+    for i in range(len(cal_list)):
+        curr_date = cal_dict['calStartDate'] + datetime.timedelta(days=i)
+        day_of_month = curr_date.day
+        if curr_date == cal_dict['today']:
+            cal_events_text += '<li><div class="datecircle">' + str(day_of_month) + '</div>\n'
+        elif curr_date.month != cal_dict['today'].month:
+            cal_events_text += '<li><div class="date text-muted">' + str(day_of_month) + '</div>\n'
+        else:
+            cal_events_text += '<li><div class="date">' + str(day_of_month) + '</div>\n'
+
+        for j in range(min(len(cal_list[i]), max_events_per_day)):
+            event = cal_list[i][j]
+            cal_events_text += '<div class="event'
+            if event['isUpdated']:
+                cal_events_text += ' text-danger'
+            elif curr_date.month != cal_dict['today'].month:
+                cal_events_text += ' text-muted'
+            if event['isMultiday']:
+                if event['startDatetime'].date() == curr_date:
+                    cal_events_text += '">►' + event['summary']
+                else:
+                    cal_events_text += '">◄' + event['summary']
+            elif event['allday']:
+                cal_events_text += '">' + event['summary']
+            else:
+                cal_events_text += '">' + render_service.get_short_time(event['startDatetime'], is24hour) + ' ' + event[
+                    'summary']
+            cal_events_text += '</div>\n'
+        if len(cal_list[i]) > max_events_per_day:
+            cal_events_text += '<div class="event text-muted">' + str(len(cal_list[i]) - max_events_per_day) + ' more'
+
+        cal_events_text += '</li>\n'
+
+    return calendar_template.format(
+        month=month_name,
+        battText=batt_text,
+        dayOfWeek=cal_days_of_week,
+        events=cal_events_text
+    )
+
+
+def bench_import(args):
+    import importlib
+
+    start = time.perf_counter()
+    epdconfig = importlib.import_module('display.epdconfig')
+    import_time = time.perf_counter() - start
+    print('import display.epdconfig: {:8.2f} ms'.format(import_time * 1000))
+
+    detect_time, so_name = timeit(epdconfig.get_library_name, args.repeat)
+    print('library detection:        {:8.2f} ms ({})'.format(detect_time * 1000, so_name))
+    try:
+        find_time, so_filename = timeit(epdconfig.find_library, 1)
+        print('library lookup:           {:8.2f} ms ({})'.format(find_time * 1000, so_filename))
+    except RuntimeError as e:
+        print('library lookup:           failed, {}'.format(e))
+
+
+def bench_init(args):
+    import display.epdconfig as epdconfig
+    from display.epd13in3E import EPD
+
+    emulator = epdconfig.use_emulator()
+    epd = EPD()
+    for name in ('cold init', 're-wake'):
+        emulator.transfers = 0
+        start_sim, start_wall = emulator.clock.monotonic(), time.perf_counter()
+        epd.Init()
+        print('{:<10} {:8.3f} s panel time {:8.3f} ms CPU time {:4d} SPI transfers'.format(
+            name + ':', emulator.clock.monotonic() - start_sim, (time.perf_counter() - start_wall) * 1000,
+            emulator.transfers))
+
+
+def sample_events(start_date, num_days, events_per_day, seed=0):
+    # synthetic events in the format returned by GcalHelper.retrieve_events, with some all-day and multi-day ones
+    rng = random.Random(seed)
+    tz = datetime.timezone.utc
+    summaries = ('Team sync', 'Dentist', 'Pick up groceries', 'Piano lesson', 'Flight to Singapore', 'Birthday party')
+    events = []
+    for day in range(num_days):
+        date = start_date + datetime.timedelta(days=day)
+        for _ in range(events_per_day):
+            start = datetime.datetime.combine(date, datetime.time(rng.randrange(7, 21), rng.choice((0, 30))), tz)
+            kind = rng.random()
+            if kind < 0.1:
+                end = start + datetime.timedelta(days=rng.randrange(1, 5))
+            elif kind < 0.2:
+                start = datetime.datetime.combine(date, datetime.time(0, 0), tz)
+                end = datetime.datetime.combine(date, datetime.time.max, tz)
+            else:
+                end = start + datetime.timedelta(minutes=rng.choice((30, 60, 90)))
+            events.append({
+                'summary': rng.choice(summaries),
+                'allday': kind >= 0.1 and kind < 0.2,
+                'startDatetime': start,
+                'endDatetime': end,
+                'updatedDatetime': start,
+                'isUpdated': rng.random() < 0.1,
+                'isMultiday': start.date() != end.date(),
+                'location': 'Google Meet Conference',
+                'description': 'None',
+            })
+    return sorted(events, key=lambda k: k['startDatetime'])
+
+
+def sample_recurring_events(start_date, num_days, num_series, seed=0):
+    # synthetic events as retrieve_events returns them for recurring events expanded into single events: daily, weekly
+    # and monthly series, some of them all-day, along with multi-day events such as trips and holidays
+    rng = random.Random(seed)
+    tz = datetime.timezone.utc
+    events = []
+
+    def add_event(start, end, allday):
+        events.append({
+            'summary': 'Series {}'.format(len(events) % num_series), 'allday': allday, 'startDatetime': start,
+            'endDatetime': end, 'updatedDatetime': start, 'isUpdated': False, 'isMultiday': start.date() != end.date(),
+            'location': '', 'description': 'None',
+        })
+
+    for _ in range(num_series):
+        first = start_date + datetime.timedelta(days=rng.randrange(num_days))
+        interval = rng.choice((1, 7, 7, 14, 30))
+        kind = rng.random()
+        for day in range((first - start_date).days, num_days, interval):
+            date = start_date + datetime.timedelta(days=day)
+            if kind < 0.15:
+                # trips and holidays, every few weeks
+                start = datetime.datetime.combine(date, datetime.time(rng.randrange(24)), tz)
+                add_event(start, start + datetime.timedelta(days=rng.randrange(1, 21)), False)
+            elif kind < 0.3:
+                add_event(datetime.datetime.combine(date, datetime.time.min, tz),
+                          datetime.datetime.combine(date, datetime.time.max, tz), True)
+            else:
+                start = datetime.datetime.combine(date, datetime.time(rng.randrange(7, 21), rng.choice((0, 30))), tz)
+                add_event(start, start + datetime.timedelta(minutes=rng.choice((30, 60, 90))), False)
+    return sorted(events, key=lambda k: k['startDatetime'])
+
+
+def legacy_month_days(events, start_date):
+    # events on each of the 35 days of the month view, as generateMonthCal placed them, multi-day events only on their
+    # first and last day
+    cal_list = [[] for _ in range(35)]
+    for event in events:
+        idx = (event['startDatetime'].date() - start_date).days
+        if 0 <= idx < len(cal_list):
+            cal_list[idx].append(event)
+        if event['isMultiday']:
+            idx = (event['endDatetime'].date() - start_date).days
+            if 0 <= idx < len(cal_list):
+                cal_list[idx].append(event)
+    return cal_list
+
+
+def legacy_day_days(events, start_date, num_days):
+    # events on each of the days of the day view, as GcalHelper.get_events placed them
+    day_list = [[] for _ in range(num_days)]
+    for event in events:
+        idx = (event['startDatetime'].date() - start_date).days
+        if event['isMultiday']:
+            end_idx = min((event['endDatetime'].date() - start_date).days, num_days - 1)
+            for i in range(max(idx, 0), end_idx + 1):
+                day_list[i].append(event)
+        elif 0 <= idx < num_days:
+            day_list[idx].append(event)
+    return day_list
+
+
+def sample_views(events_per_day=2):
+    # arguments for RenderHelper.generateMonthCal and generateDailyCal
+    from gcal.eventindex import EventIndex
+
+    today = datetime.date(2026, 10, 14)
+    start_date = today - datetime.timedelta(days=(today.weekday() + 1) % 7)
+    events = sample_events(start_date, 35, events_per_day)
+    month_dict = {
+        'eventIndex': EventIndex(events),
+        'calStartDate': start_date,
+        'today': today,
+        'lastRefresh': datetime.datetime.combine(today, datetime.time(6, 0)),
+        'batteryLevel': 75.0,
+        'batteryDisplayMode': 1,
+        'dayOfWeekText': ["M", "T", "W", "T", "F", "S", "S"],
+        'weekStartDay': 6,
+        'maxEventsPerDay': 3,
+        'is24hour': False,
+    }
+    weather = {'weather': [{'id': 500, 'description': 'light rain'}], 'temp': 21.5, 'pop': 0.4}
+    day_events = [[event for event in events if event['startDatetime'].date() == today + datetime.timedelta(days=i)]
+                  for i in range(4)]
+    daily_args = (today, weather, [weather] * 7, [weather] * 7, ['6 AM', '7 AM', '8 AM', '9 AM', '10 AM', '11 AM', '12 PM'],
+                  day_events, 4, 4, {'batteryLevel': 75.0, 'batteryDisplayMode': 1})
+    return month_dict, daily_args
+
+
+class FakeCalendarHandler(http.server.BaseHTTPRequestHandler):
+    # Answers events().list requests of the Calendar API from FakeCalendarHandler.calendars, paging, sync tokens and
+    # all, with a delay for each request and for the size of the response, as over the Wi-Fi of a Pi Zero
+
+    calendars = {}  # events by id of each calendar, as the Calendar API returns them
+    changes = []  # (sequence, calendar id, event id) of each change, sync tokens are sequence numbers
+    expired = 0  # sync tokens before this sequence number get 410 Gone
+    latency = 0.0
+    bandwidth = float('inf')
+    max_page_size = 2500  # events on a page at most, whatever maxResults asks for
+    stats = {'requests': 0, 'bytes': 0, 'parse': 0.0}  # parse is the time taken to decode the JSON of the responses
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = {name: values[0] for name, values in urllib.parse.parse_qs(url.query).items()}
+        calendar = urllib.parse.unquote(url.path.split('/')[-2])
+        if calendar not in self.calendars:
+            return self.reply(404, {'error': {'code': 404, 'message': 'Not Found'}})
+        events = self.calendars[calendar]
+        sequence = len(self.changes)
+
+        if 'syncToken' in query:
+            if int(query['syncToken']) < self.expired:
+                return self.reply(410, {'error': {'code': 410, 'message': 'Sync token is no longer valid.'}})
+            changed = {event_id for seq, cal, event_id in self.changes[int(query['syncToken']):] if cal == calendar}
+            items = [events[event_id] for event_id in sorted(changed)]
+        else:
+            time_min, time_max = (datetime.datetime.fromisoformat(query[name]) for name in ('timeMin', 'timeMax'))
+            items = sorted((event for event in events.values() if event['status'] != 'cancelled' and
+                            parse_time(event['end']) > time_min and parse_time(event['start']) < time_max),
+                           key=lambda event: parse_time(event['start']))
+
+        offset = int(query.get('pageToken', 0))
+        page_size = min(int(query.get('maxResults', 250)), self.max_page_size)
+        body = {'kind': 'calendar#events', 'summary': calendar, 'timeZone': 'America/New_York',
+                'items': items[offset:offset + page_size]}
+        if offset + page_size < len(items):
+            body['nextPageToken'] = str(offset + page_size)
+        else:
+            body['nextSyncToken'] = str(sequence)
+        if 'fields' in query:
+            body = select_fields(body, parse_fields(query['fields']))
+        self.reply(200, body)
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        time.sleep(self.latency + len(data) / self.bandwidth)
+        start = time.perf_counter()
+        json.loads(data)
+        FakeCalendarHandler.stats['parse'] += time.perf_counter() - start
+        FakeCalendarHandler.stats['requests'] += 1
+        FakeCalendarHandler.stats['bytes'] += len(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_fields(fields):
+    # {'nextPageToken': None, 'items': {'id': None, 'start': None}} for a fields parameter of 'nextPageToken,items(id,start)'
+    tree = {}
+    parents = []
+    name = ''
+    for char in fields + ',':
+        if char == '(':
+            parents.append(tree)
+            tree[name.strip()] = tree = {}
+            name = ''
+        elif char in ',)':
+            if name.strip():
+                tree[name.strip()] = None
+            name = ''
+            if char == ')':
+                tree = parents.pop()
+        else:
+            name += char
+    return tree
+
+
+def select_fields(value, tree):
+    # the partial response the Calendar API returns for the fields in tree, see parse_fields
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [select_fields(item, tree) for item in value]
+    return {name: select_fields(value[name], subtree) for name, subtree in tree.items() if name in value}
+
+
+def parse_time(when):
+    return datetime.datetime.fromisoformat(when['dateTime'].replace('Z', '+00:00'))
+
+
+def fake_calendar_event(calendar, index, start, rng):
+    # an event with the fields the Calendar API returns for a typical meeting
+    end = start + datetime.timedelta(minutes=rng.choice((30, 60, 90)))
+    return {
+        'kind': 'calendar#event', 'etag': '"{}"'.format(rng.getrandbits(48)), 'id': '{}evt{:05d}'.format(calendar[:3], index),
+        'status': 'confirmed', 'htmlLink': 'https://www.google.com/calendar/event?eid={:032x}'.format(rng.getrandbits(128)),
+        'created': '2026-01-05T10:00:00.000Z', 'updated': '2026-01-05T10:00:00.000Z',
+        'summary': rng.choice(('Team sync', 'Dentist', 'School run', 'Standup', '1:1', 'Yoga')),
+        'description': 'Agenda and notes are in the shared document.', 'location': 'https://meet.google.com/abc-defg-hij',
+        'creator': {'email': 'someone@example.com'}, 'organizer': {'email': calendar, 'self': True},
+        'start': {'dateTime': start.strftime('%Y-%m-%dT%H:%M:%SZ'), 'timeZone': 'America/New_York'},
+        'end': {'dateTime': end.strftime('%Y-%m-%dT%H:%M:%SZ'), 'timeZone': 'America/New_York'},
+        'iCalUID': '{:032x}@google.com'.format(rng.getrandbits(128)), 'sequence': 0,
+        'reminders': {'useDefault': True}, 'eventType': 'default',
+    }
+
+
+def start_fake_calendar(calendars, events_per_calendar, start_date, latency, bandwidth):
+    # Starts a fake Calendar API in a thread and returns a service for GcalHelper that talks to it
+    import httplib2
+    from googleapiclient.discovery import build
+
+    rng = random.Random(0)
+    FakeCalendarHandler.calendars = {}
+    for calendar in calendars:
+        events = {}
+        for i in range(events_per_calendar):
+            start = datetime.datetime.combine(start_date, datetime.time(12)) + datetime.timedelta(
+                days=rng.randrange(70), hours=rng.randrange(10))
+            event = fake_calendar_event(calendar, i, start, rng)
+            events[event['id']] = event
+        FakeCalendarHandler.calendars[calendar] = events
+    FakeCalendarHandler.changes = []
+    FakeCalendarHandler.expired = 0
+    FakeCalendarHandler.max_page_size = 2500
+    FakeCalendarHandler.latency = latency
+    FakeCalendarHandler.bandwidth = bandwidth
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeCalendarHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service = build('calendar', 'v3', http=httplib2.Http(), developerKey='benchmark', static_discovery=True,
+                    client_options={'api_endpoint': 'http://127.0.0.1:{}/calendar/v3/'.format(server.server_address[1])})
+    return server, service
+
+
+class FakeCalendar:
+    """
+    The fake Calendar API along with the month view window used by the gcal checks, as a context manager that stops
+    the server and undoes patch_views on the way out.
+    """
+
+    def __init__(self, calendars, events_per_calendar, latency, bandwidth, today=None, week_start_day=6,
+                 tz_name='America/New_York'):
+        import pytz
+
+        self.calendars = calendars
+        self.tz = pytz.timezone(tz_name)
+        self.today = today or datetime.date(2026, 10, 14)
+        # the month view starts on the week start day on or before today, as in maginkcal.get_calendar_views
+        self.start_date = self.today - datetime.timedelta(days=(self.today.weekday() + 7 - week_start_day) % 7)
+        self.window_start, self.window_end = self.get_window(self.start_date, 35)
+        self.server, self.service = start_fake_calendar(calendars, events_per_calendar, self.start_date, latency,
+                                                        bandwidth * 1024)
+        self.patches = []  # (module, name, value before) of each patched global
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            for module, name, value in reversed(self.patches):
+                if value is None:
+                    del module[name]
+                else:
+                    module[name] = value
+        finally:
+            self.server.shutdown()
+        return False
+
+    def get_window(self, first_date, num_days):
+        # start and end datetimes of num_days days from first_date
+        return (self.tz.localize(datetime.datetime.combine(first_date, datetime.time.min)),
+                self.tz.localize(datetime.datetime.combine(first_date + datetime.timedelta(days=num_days - 1),
+                                                           datetime.time.max)))
+
+    def patch(self, module, name, value):
+        self.patches.append((module, name, module.get(name)))
+        module[name] = value
+
+    def patch_views(self):
+        """
+        Makes maginkcal.get_calendar_views talk to the fake Calendar API, with a made up forecast instead of
+        OpenWeatherMap.
+        """
+        import functools
+        import gcal.gcal
+
+        weather = {'weather': [{'id': 500, 'description': 'light rain'}], 'temp': 21.5, 'pop': 0.4}
+        owm_module = types.ModuleType('owm.owm')
+        owm_module.OWMModule = lambda: types.SimpleNamespace(
+            get_weather=lambda *args: (weather, [weather] * 7, [weather] * 7))
+        self.patch(sys.modules, 'owm.owm', owm_module)
+        self.patch(vars(gcal.gcal), 'GcalHelper', functools.partial(gcal.gcal.GcalHelper, service=self.service))
+
+    def fetch(self, label, func, count=len):
+        # runs func and prints what it took and what went over the network, count being the events it returned
+        FakeCalendarHandler.stats.update(requests=0, bytes=0, parse=0.0)
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        print('{:<28} {:6.2f} s  {:3d} requests  {:8.1f} kB  parsed in {:6.1f} ms  {:5d} events'.format(
+            label, elapsed, FakeCalendarHandler.stats['requests'], FakeCalendarHandler.stats['bytes'] / 1024,
+            FakeCalendarHandler.stats['parse'] * 1000, count(result)))
+        return result
+
+
+def bench_gcal_sync(args):
+    import tempfile
+    from gcal.gcal import GcalHelper
+    from gcal.store import EventStore
+
+    calendars = ['family@example.com', 'work@example.com', 'holidays@example.com']
+
+    def edit_events(count):
+        # moves, renames, adds and deletes a few events, as happens between two boots
+        rng = random.Random(count)
+        for calendar in calendars:
+            events = FakeCalendarHandler.calendars[calendar]
+            for event_id in rng.sample(sorted(events), count):
+                event = dict(events[event_id], summary='Moved', updated='2026-10-14T08:00:00.000Z')
+                if rng.random() < 0.2:
+                    event['status'] = 'cancelled'
+                events[event_id] = event
+                FakeCalendarHandler.changes.append((len(FakeCalendarHandler.changes), calendar, event_id))
+
+    with FakeCalendar(calendars, args.events, args.latency, args.bandwidth) as fake, \
+            tempfile.TemporaryDirectory() as store_dir:
+        def boot(label, gcal_service):
+            return fake.fetch(label, lambda: gcal_service.retrieve_events(calendars, fake.window_start,
+                                                                          fake.window_end, fake.tz, 24))
+
+        full_service = GcalHelper(service=fake.service)
+        sync_service = GcalHelper(service=fake.service, store=EventStore(store_dir + '/events.sqlite'))
+        boot('full download', full_service)
+        boot('sync, first boot', sync_service)
+        edit_events(args.changes)
+        synced = boot('sync, {} changes'.format(args.changes * len(calendars)), sync_service)
+        expected = boot('full download', full_service)
+        if sorted(map(repr, synced)) != sorted(map(repr, expected)):
+            raise RuntimeError('Events synced incrementally differ from a full download')
+        boot('sync, no changes', sync_service)
+        FakeCalendarHandler.expired = len(FakeCalendarHandler.changes) + 1
+        edit_events(args.changes)
+        boot('sync, sync token expired', sync_service)
+
+
+def bench_gcal_fetch(args):
+    from gcal.gcal import GcalHelper
+
+    calendars = ['calendar{}@example.com'.format(i) for i in range(args.calendars)]
+    with FakeCalendar(calendars, args.events, args.latency, args.bandwidth) as fake:
+        # one calendar the server does not know about, which should not hold up or take down the others
+        for label, calendar_ids in (('all calendars', calendars), ('one missing', calendars[:-1] + ['missing@example.com'])):
+            for workers in (1, args.workers):
+                gcal_service = GcalHelper(service=fake.service, max_workers=workers)
+                fake.fetch('{}, {} worker{}'.format(label, workers, '' if workers == 1 else 's'),
+                           lambda: gcal_service.retrieve_events(calendar_ids, fake.window_start, fake.window_end,
+                                                                fake.tz, 24))
+
+
+def legacy_retrieve_calendar(gcal_service, calendar, start, end, tz, all_pages):
+    # events of a calendar asked for with every field, as before the field mask, and only their first page unless
+    # all_pages, as retrieve_events did before it followed the page tokens
+    request = gcal_service.service.events().list(calendarId=calendar, timeMin=start.isoformat(), timeMax=end.isoformat(),
+                                                 singleEvents=True, orderBy='startTime')
+    events = []
+    while request is not None:
+        result = request.execute(http=gcal_service.get_http())
+        events += [gcal_service.to_event(event, tz, 24) for event in result.get('items', [])]
+        request = gcal_service.service.events().list_next(request, result) if all_pages else None
+    return events
+
+
+def bench_gcal_pages(args):
+    from gcal.gcal import GcalHelper
+
+    calendar = 'busy@example.com'
+    with FakeCalendar([calendar], args.events, args.latency, args.bandwidth) as fake:
+        # a server that pages more often than the page size asked for, as the Calendar API may
+        FakeCalendarHandler.max_page_size = args.page_size
+        gcal_service = GcalHelper(service=fake.service)
+        fake.fetch('first page, every field', lambda: legacy_retrieve_calendar(
+            gcal_service, calendar, fake.window_start, fake.window_end, fake.tz, False))
+        expected = fake.fetch('all pages, every field', lambda: legacy_retrieve_calendar(
+            gcal_service, calendar, fake.window_start, fake.window_end, fake.tz, True))
+        events = fake.fetch('all pages, field mask', lambda: gcal_service.retrieve_events(
+            [calendar], fake.window_start, fake.window_end, fake.tz, 24))
+        if sorted(map(repr, events)) != sorted(map(repr, expected)):
+            raise RuntimeError('Events fetched with the field mask differ from those fetched with every field')
+
+
+def bench_eventindex(args):
+    from gcal.eventindex import EventIndex
+
+    start_date = datetime.date(2026, 1, 4)
+    events = sample_recurring_events(start_date, args.days, args.series)
+    month_start = start_date + datetime.timedelta(days=args.days // 2)
+    # what is on each day, checked against every event one by one
+    expected = [[event for event in events if event['startDatetime'].date() <= month_start + datetime.timedelta(days=i)
+                 <= max(event['startDatetime'], event['endDatetime']).date()] for i in range(35)]
+    print('{} events, {} over several days'.format(len(events), sum(event['isMultiday'] for event in events)))
+
+    build_time, index = timeit(lambda: EventIndex(events), args.repeat)
+    legacy_time, legacy_list = timeit(lambda: legacy_month_days(events, month_start), args.repeat)
+    index_time, cal_list = timeit(lambda: index.get_days(month_start, 35), args.repeat)
+    if cal_list != expected:
+        raise RuntimeError('Month view days differ from the events on each day')
+    missing = sum(len(day) for day in expected) - sum(len(day) for day in legacy_list)
+    print('month view, 35 days:  legacy {:7.2f} ms ({} placements missing)  index {:7.2f} ms  index built in {:.2f} ms'.format(
+        legacy_time * 1000, missing, index_time * 1000, build_time * 1000))
+
+    legacy_time, legacy_list = timeit(lambda: legacy_day_days(events, month_start, 4), args.repeat)
+    index_time, day_list = timeit(lambda: index.get_days(month_start, 4), args.repeat)
+    if day_list != expected[:4] or legacy_list != day_list:
+        raise RuntimeError('Day view days differ from the events on each day')
+    print('day view, 4 days:     legacy {:7.2f} ms  index {:7.2f} ms'.format(legacy_time * 1000, index_time * 1000))
+
+    # one event going on for the whole year among many short ones, which is placed on each of its days once, when the
+    # index is built, rather than looked for again on every day of the views
+    rng = random.Random(1)
+    year_start = datetime.datetime.combine(start_date, datetime.time(9), datetime.timezone.utc)
+    events = [{'summary': 'Sabbatical', 'allday': False, 'startDatetime': year_start,
+               'endDatetime': year_start + datetime.timedelta(days=365), 'isMultiday': True}]
+    for _ in range(args.short_events):
+        start = year_start + datetime.timedelta(minutes=rng.randrange(365 * 24 * 60))
+        events.append({'summary': 'Short', 'allday': False, 'startDatetime': start,
+                       'endDatetime': start + datetime.timedelta(minutes=rng.choice((15, 30, 60))), 'isMultiday': False})
+    build_time, index = timeit(lambda: EventIndex(events), args.repeat)
+    expected = [[event for event in index.events if event['startDatetime'].date() <= month_start + datetime.timedelta(
+        days=i) <= max(event['startDatetime'], event['endDatetime']).date()] for i in range(35)]
+    legacy_time, legacy_list = timeit(lambda: legacy_month_days(index.events, month_start), args.repeat)
+    index_time, cal_list = timeit(lambda: index.get_days(month_start, 35), args.repeat)
+    if cal_list != expected:
+        raise RuntimeError('Month view days differ from the events on each day, with a year-long event')
+    print('month view, {} events and one over the year:  legacy {:7.2f} ms  index {:7.2f} ms  index built in {:.2f} ms'.format(
+        len(events), legacy_time * 1000, index_time * 1000, build_time * 1000))
+
+
+def bench_gcal_views(args):
+    import pytz
+    import maginkcal
+    from gcal.gcal import GcalHelper
+
+    config = maginkcal.load_config()
+    calendars = ['calendar{}@example.com'.format(i) for i in range(args.calendars)]
+    config.update(calendars=calendars, isIncrementalSync=False)
+    num_days = config['maxDayFetchForDayView']
+
+    def count_day_events(day_lists):
+        return sum(len(day) for day in day_lists)
+
+    with FakeCalendar(calendars, args.events, args.latency, args.bandwidth,
+                      today=datetime.datetime.now(pytz.timezone(config['displayTZ'])).date(),
+                      week_start_day=config['weekStartDay'], tz_name=config['displayTZ']) as fake:
+        def legacy_views():
+            # the month view window and then the day view window, fetched one after the other
+            gcal_service = GcalHelper(service=fake.service, max_workers=config['maxCalendarFetchWorkers'])
+            gcal_service.retrieve_events(calendars, fake.window_start, fake.window_end, fake.tz, config['thresholdHours'])
+            day_start, day_end = fake.get_window(fake.today, num_days)
+            return gcal_service.get_events(fake.today, calendars, day_start, day_end, fake.tz, num_days,
+                                           config['thresholdHours'])
+
+        expected = fake.fetch('two fetches', legacy_views, count_day_events)
+        fake.patch_views()
+        views = fake.fetch('one fetch, event index', lambda: maginkcal.get_calendar_views(
+            config, logging.getLogger('maginkcal'), 75.0), lambda views: count_day_events(views[0][2][5]) if views else 0)
+        if views is None:
+            raise RuntimeError('Views could not be made, see the log')
+        if FakeCalendarHandler.stats['requests'] != len(calendars):
+            raise RuntimeError('{} requests for {} calendars'.format(FakeCalendarHandler.stats['requests'], len(calendars)))
+        if views[0][2][5] != expected:
+            raise RuntimeError('Day view events differ from those fetched for the day view window')
+
+
+def bench_render_one(args):
+    # renders both views with one backend and reports its own timings, see bench_render
+    from render.render import RenderHelper
+
+    month_dict, daily_args = sample_views()
+    # without the render cache, so that every view is actually rendered
+    render_service = RenderHelper(1200, 1600, 0, args.backend, cache_size=0,
+                                  optimize_templates=not args.source_templates)
+    start = time.perf_counter()
+    render_service.generateMonthCal(month_dict).save(args.output + '-month.png')
+    month_time = time.perf_counter() - start
+    start = time.perf_counter()
+    render_service.generateDailyCal(*daily_args).save(args.output + '-day.png')
+    day_time = time.perf_counter() - start
+    startup_time = render_service.browser.startupTime if render_service.browser else 0.0
+
+    # both views again, one after the other now that fonts and templates are loaded, then at the same time, as
+    # maginkcal renders them
+    start = time.perf_counter()
+    render_service.generateDailyCal(*daily_args)
+    render_service.generateMonthCal(month_dict)
+    sequential_time = time.perf_counter() - start
+    start = time.perf_counter()
+    first_time = None
+    for _ in render_service.render_views([('day', 'generateDailyCal', daily_args), ('month', 'generateMonthCal', (month_dict,))]):
+        first_time = first_time or time.perf_counter() - start
+    parallel_time = time.perf_counter() - start
+    render_service.close()
+
+    # peak resident memory in kB, of this process and of the browser processes it started
+    print(json.dumps({
+        'month': month_time,
+        'day': day_time,
+        'startup': startup_time,
+        'sequential': sequential_time,
+        'first': first_time,
+        'parallel': parallel_time,
+        'pages': render_service.get_timings(),
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'children_rss': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }))
+
+
+def ink_mask(image):
+    # pixels that are not white or nearly so, i.e. text, lines, icons and the colored parts of the view
+    import numpy as np
+
+    return np.asarray(image.convert('RGB')).min(axis=2) < 224
+
+
+def ink_diff(mask_a, mask_b, slack=2):
+    """
+    Fraction of the pixels in ink in either mask that have no ink within slack pixels in the other, so that text set a
+    pixel or two apart still matches while missing or extra text does not. Blank against anything in ink gives 1.
+    """
+    import numpy as np
+
+    def dilate(mask):
+        padded = np.pad(mask, slack)
+        grown = np.zeros_like(mask)
+        for dy in range(2 * slack + 1):
+            for dx in range(2 * slack + 1):
+                grown |= padded[dy:dy + mask.shape[0], dx:dx + mask.shape[1]]
+        return grown
+
+    ink = mask_a | mask_b
+    if not ink.any():
+        return 0.0
+    unmatched = (mask_a & ~dilate(mask_b)) | (mask_b & ~dilate(mask_a))
+    return unmatched.sum() / ink.sum()
+
+
+def bench_render(args):
+    import tempfile
+    from PIL import Image
+
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for backend in ('chrome', 'native'):
+            output = '{}/{}'.format(output_dir, backend)
+            process = subprocess.run([sys.executable, __file__, 'render-one', backend, output],
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if process.returncode != 0:
+                print('{:<7} failed: {}'.format(backend, process.stderr.strip().splitlines()[-1]))
+                continue
+            stats = json.loads(process.stdout.strip().splitlines()[-1])
+            results[backend] = output
+            print('{:<7} month {:7.2f} s  day {:7.2f} s  peak RSS {:6.0f} MB (browser {:6.0f} MB)'.format(
+                backend, stats['month'], stats['day'], stats['rss'] / 1024, stats['children_rss'] / 1024))
+            print('        in parallel: first view after {:.2f} s, both after {:.2f} s ({:.2f} s one after the other)'.format(
+                stats['first'], stats['parallel'], stats['sequential']))
+            if stats['pages']:
+                # with a shared browser session, only the first page pays for starting Chrome
+                print('        browser startup {:.2f} s, {}'.format(stats['startup'], ', '.join(
+                    '{} {:.2f} s'.format(page, seconds) for page, seconds in stats['pages'])))
+
+        if 'native' not in results:
+            raise RuntimeError('Native views could not be rendered, see the failure above')
+        for view in ('month', 'day'):
+            native = ink_mask(Image.open(results['native'] + '-' + view + '.png'))
+            # a blank or half drawn view has far less text and lines than the 4-5% of pixels a full one has
+            print('{:<5} view: {:.2%} of native pixels are ink'.format(view, native.mean()))
+            if native.mean() < args.min_ink:
+                raise RuntimeError('{} view drawn natively has {:.2%} of pixels in ink, less than {:.2%}'.format(
+                    view.capitalize(), native.mean(), args.min_ink))
+            if 'chrome' not in results:
+                continue
+            diff = ink_diff(ink_mask(Image.open(results['chrome'] + '-' + view + '.png')), native)
+            print('{:<5} view: {:.2%} of ink pixels differ between chrome and native'.format(view, diff))
+            if diff > args.max_diff:
+                raise RuntimeError('{} view drawn natively differs from Chrome in {:.2%} of ink pixels, more than {:.2%}'.format(
+                    view.capitalize(), diff, args.max_diff))
+        if 'chrome' not in results:
+            print('Chrome is not available, the native views were only checked for ink')
+
+
+def bench_templates(args):
+    from render.render import RenderHelper
+
+    # the legacy HTML is made from the original template
+    render_service = RenderHelper(1200, 1600, 0, optimize_templates=False)
+    for events_per_day in (10, 100, 500):
+        month_dict, _ = sample_views(events_per_day)
+        # show every event, so that the size of the page grows with the number of events
+        month_dict['maxEventsPerDay'] = events_per_day * 2
+        cal_list = [[] for _ in range(35)]
+        for event in month_dict['eventIndex'].events:
+            cal_list[(event['startDatetime'].date() - month_dict['calStartDate']).days].append(event)
+
+        legacy_time, legacy_html = timeit(lambda: legacy_month_html(render_service, month_dict, cal_list, '10', 'battery60'),
+                                          args.repeat)
+        compiled_time, compiled_html = timeit(lambda: render_service.get_month_html(month_dict, cal_list, '10', 'battery60'),
+                                              args.repeat)
+        if legacy_html != compiled_html:
+            raise RuntimeError('Month view HTML differs from the legacy string concatenation')
+        print('{:4d} events/day ({:6.1f} kB): legacy {:8.2f} ms  compiled {:8.2f} ms ({:.1f}x faster)'.format(
+            events_per_day, len(compiled_html) / 1024, legacy_time * 1000, compiled_time * 1000,
+            legacy_time / compiled_time))
+
+
+def bench_build(args):
+    import tempfile
+    from render.build import TemplateBuilder
+
+    builder = TemplateBuilder()
+    for name in ('calendar', 'dashboard'):
+        build_time, _ = timeit(lambda: builder.build(name), args.repeat)
+        stats = builder.stats[name]
+        print('{:<9} built in {:6.1f} ms: CSS {:6.1f} kB -> {:6.1f} kB, fonts {:6.1f} kB -> {:6.1f} kB'.format(
+            name, build_time * 1000, stats['css_before'] / 1024, stats['css_after'] / 1024,
+            stats['font_before'] / 1024, stats['font_after'] / 1024))
+
+    # time taken by the browser for each page, with the original and the built templates
+    with tempfile.TemporaryDirectory() as output_dir:
+        for label, extra in (('source', ['--source-templates']), ('built', [])):
+            process = subprocess.run([sys.executable, __file__, 'render-one', 'chrome', output_dir + '/' + label] + extra,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if process.returncode != 0:
+                print('{:<9} chrome failed: {}'.format(label, process.stderr.strip().splitlines()[-1]))
+                continue
+            stats = json.loads(process.stdout.strip().splitlines()[-1])
+            print('{:<9} {}'.format(label, ', '.join('{} {:.2f} s'.format(page, seconds)
+                                                      for page, seconds in stats['pages'])))
+
+
+def bench_pack(args):
+    from display.epd13in3E import EPD
+
+    epd = EPD()
+    buf_7color = random_frame(epd.width, epd.height)
+
+    legacy_time, legacy_buf = timeit(lambda: legacy_packbuffer(buf_7color, epd.width, epd.height), args.repeat)
+    packed_time, packed_buf = timeit(lambda: epd.packbuffer(buf_7color), args.repeat)
+
+    if bytes(legacy_buf) != bytes(packed_buf):
+        raise RuntimeError('Packed frame differs from the legacy packing loop')
+
+    print('legacy loop: {:8.1f} ms'.format(legacy_time * 1000))
+    print('packbuffer:  {:8.1f} ms ({:.0f}x faster, bit-identical)'.format(packed_time * 1000, legacy_time / packed_time))
+
+
+def bench_spi(args):
+    import display.epdconfig as epdconfig
+    from display.epd13in3E import EPD
+    from display.fake_devconfig import FakeDevConfig
+
+    backend = FakeDevConfig()
+    epdconfig.use_backend(backend)
+    epd = EPD()
+    packed = epd.packbuffer(random_frame(epd.width, epd.height))
+    legacy_image = list(packed)
+
+    def bulk_transfer():
+        buf_m, buf_s = epd.splitbuffer(packed)
+        epdconfig.spi_writebuf(buf_m)
+        epdconfig.spi_writebuf(buf_s)
+
+    for name, func in (('row-by-row', lambda: legacy_transfer(epdconfig, legacy_image, epd.width, epd.height)),
+                       ('bulk', bulk_transfer)):
+        backend.bytes_sent = backend.transfers = 0
+        elapsed, _ = timeit(func, 1)
+        print('{:<11} {:8.1f} ms  {:7.1f} MB/s  {} transfers'.format(
+            name + ':', elapsed * 1000, backend.bytes_sent / elapsed / 1e6, backend.transfers))
+
+
+def bench_quantize(args):
+    import tempfile
+    from display.quantizer import Quantizer, DITHER_MODES
+
+    image = sample_image(1200, 1600)
+    legacy_time, legacy_buf = timeit(lambda: legacy_quantize(image), args.repeat)
+    print('legacy PIL:          {:8.1f} ms'.format(legacy_time * 1000))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for mode in DITHER_MODES:
+            quantizer = Quantizer(dither=mode, cache_dir=cache_dir)
+            cold_time, _ = timeit(lambda: quantizer.quantize(image), 1)
+            warm_time, buf = timeit(lambda: quantizer.quantize(image), args.repeat)
+            note = ''
+            if mode == 'diffusion':
+                note = 'bit-identical' if buf.tobytes() == legacy_buf else 'DIFFERS from legacy'
+            print('{:<20} {:8.1f} ms (first call {:.1f} ms) {}'.format(mode + ':', warm_time * 1000, cold_time * 1000, note))
+
+        # a fresh quantizer only has to load the table that was cached on disk above
+        quantizer = Quantizer(dither='none', cache_dir=cache_dir)
+        load_time, _ = timeit(quantizer.get_lut, 1)
+        print('cached table load:   {:8.1f} ms'.format(load_time * 1000))
+
+
+def bench_palette(args):
+    import os
+    import numpy as np
+    from PIL import Image
+    from display.epd13in3E import EPD
+    from display.quantizer import Quantizer, PANEL_COLORS, DEFAULT_PALETTE
+    from render.render import RenderHelper
+
+    month_dict, daily_args = sample_views()
+    colors = np.zeros((16, 3), dtype=np.uint8)
+    for name, code in PANEL_COLORS.items():
+        colors[code] = DEFAULT_PALETTE[name]
+
+    frames = {}
+    for palette_native in (False, True):
+        mode = 'palette-native' if palette_native else 'full color'
+        render_service = RenderHelper(1200, 1600, 0, args.backend, cache_size=0, palette_native=palette_native)
+        epd = EPD(Quantizer(dither='diffusion'))
+        for view, method, view_args in (('month', 'generateMonthCal', (month_dict,)),
+                                        ('day', 'generateDailyCal', daily_args)):
+            render_time, image = timeit(lambda: getattr(render_service, method)(*view_args), args.repeat)
+            prepare_time, buf = timeit(lambda: epd.getbuffer(image), args.repeat)
+            exact = epd.quantizer.get_exact_codes(image) is not None
+            frames[(view, palette_native)] = np.frombuffer(bytes(buf), dtype=np.uint8)
+            print('{:<15} {:<5} render {:8.1f} ms  prepare {:8.1f} ms ({})'.format(
+                mode, view, render_time * 1000, prepare_time * 1000, 'mapped directly' if exact else 'quantized'))
+        render_service.close()
+
+    for view in ('month', 'day'):
+        # fraction of panel pixels that end up a different color, and what the panel would show in each mode
+        pixels = {}
+        for palette_native in (False, True):
+            frame = frames[(view, palette_native)]
+            pixels[palette_native] = np.empty(frame.size * 2, dtype=np.uint8)
+            pixels[palette_native][0::2] = frame >> 4
+            pixels[palette_native][1::2] = frame & 0x0F
+        print('{:<5} view: {:.2%} of panel pixels differ between the two modes'.format(
+            view, np.mean(pixels[False] != pixels[True])))
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+            for palette_native, suffix in ((False, 'full-color'), (True, 'palette-native')):
+                Image.fromarray(colors[pixels[palette_native]].reshape(1600, 1200, 3), 'RGB').save(
+                    '{}/{}-{}.png'.format(args.output, view, suffix))
+
+
+def bench_display(args):
+    import tempfile
+    import display.epdconfig as epdconfig
+    from display.display import DisplayHelper
+
+    emulator = epdconfig.use_emulator()
+    image = sample_image(1200, 1600)
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        phases = []
+
+        def phase(name, func):
+            start_sim, start_wall = emulator.clock.monotonic(), time.perf_counter()
+            result = func()
+            phases.append((name, emulator.clock.monotonic() - start_sim, time.perf_counter() - start_wall))
+            return result
+
+        display_service = phase('init', lambda: DisplayHelper(1200, 1600))
+        display_service.stateFile = state_dir + '/last_frame.json'
+        display_service.frameFile = state_dir + '/last_frame.bin'
+        buf = phase('prepare', lambda: display_service.prepare(image))
+        phase('show', lambda: display_service.show(buf))
+        phase('show unchanged', lambda: display_service.show(buf))
+        phase('sleep', display_service.sleep)
+
+    if emulator.displayed != bytes(buf):
+        raise RuntimeError('Frame rebuilt by the emulator differs from the frame that was sent')
+
+    print('{:<16} {:>12} {:>12}'.format('phase', 'panel time', 'CPU time'))
+    for name, sim_time, wall_time in phases:
+        print('{:<16} {:10.3f} s {:10.3f} s'.format(name, sim_time, wall_time))
+    print('{} commands, {} refreshes, {} bytes over SPI in {} transfers'.format(
+        len(emulator.stream), emulator.refreshes, emulator.bytes_sent, emulator.transfers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs per measurement, best time is reported')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    subparsers.add_parser('build', help='pruned CSS and subset fonts inlined into the templates').set_defaults(
+        func=bench_build)
+    subparsers.add_parser('display', help='end-to-end display update on the emulated panel').set_defaults(func=bench_display)
+    eventindex = subparsers.add_parser('eventindex', help='events placed on the days of both views, with recurring and '
+                                       'multi-day events')
+    eventindex.add_argument('--series', type=int, default=300, help='number of recurring series')
+    eventindex.add_argument('--days', type=int, default=365, help='days the series go over')
+    eventindex.add_argument('--short-events', type=int, default=50000,
+                            help='short events around an event that goes on for a year')
+    eventindex.set_defaults(func=bench_eventindex)
+    gcal_fetch = subparsers.add_parser('gcal-fetch', help='several calendars fetched one by one and at the same time')
+    gcal_fetch.add_argument('--calendars', type=int, default=5, help='number of calendars')
+    gcal_fetch.add_argument('--events', type=int, default=100, help='events per calendar over 10 weeks')
+    gcal_fetch.add_argument('--workers', type=int, default=4, help='calendars fetched at the same time')
+    gcal_fetch.add_argument('--latency', type=float, default=0.3, help='seconds added to each request')
+    gcal_fetch.add_argument('--bandwidth', type=float, default=250, help='kB/s of the simulated Wi-Fi link')
+    gcal_fetch.set_defaults(func=bench_gcal_fetch)
+    gcal_pages = subparsers.add_parser('gcal-pages', help='a calendar of many pages, with and without the field mask')
+    gcal_pages.add_argument('--events', type=int, default=2000, help='events over 10 weeks')
+    gcal_pages.add_argument('--page-size', type=int, default=100, help='events per page the fake server returns at most')
+    gcal_pages.add_argument('--latency', type=float, default=0.1, help='seconds added to each request')
+    gcal_pages.add_argument('--bandwidth', type=float, default=250, help='kB/s of the simulated Wi-Fi link')
+    gcal_pages.set_defaults(func=bench_gcal_pages)
+    gcal_views = subparsers.add_parser('gcal-views', help='events for both views fetched once, with maginkcal')
+    gcal_views.add_argument('--calendars', type=int, default=3, help='number of calendars')
+    gcal_views.add_argument('--events', type=int, default=300, help='events per calendar over 10 weeks')
+    gcal_views.add_argument('--latency', type=float, default=0.3, help='seconds added to each request')
+    gcal_views.add_argument('--bandwidth', type=float, default=250, help='kB/s of the simulated Wi-Fi link')
+    gcal_views.set_defaults(func=bench_gcal_views)
+    gcal_sync = subparsers.add_parser('gcal-sync', help='incremental calendar sync against a fake Calendar API')
+    gcal_sync.add_argument('--events', type=int, default=300, help='events per calendar over 10 weeks')
+    gcal_sync.add_argument('--changes', type=int, default=3, help='events changed per calendar between boots')
+    gcal_sync.add_argument('--latency', type=float, default=0.1, help='seconds added to each request')
+    gcal_sync.add_argument('--bandwidth', type=float, default=250, help='kB/s of the simulated Wi-Fi link')
+    gcal_sync.set_defaults(func=bench_gcal_sync)
+    subparsers.add_parser('import', help='import and hardware detection of epdconfig').set_defaults(func=bench_import)
+    subparsers.add_parser('init', help='panel init sequence on the emulated panel').set_defaults(func=bench_init)
+    subparsers.add_parser('pack', help='4-bit nibble packing of a full panel frame').set_defaults(func=bench_pack)
+    palette = subparsers.add_parser('palette', help='palette-native rendering against rendering in full color')
+    palette.add_argument('--backend', choices=('chrome', 'native'), default='native')
+    palette.add_argument('--output', help='folder to save what the panel would show in either mode')
+    palette.set_defaults(func=bench_palette)
+    subparsers.add_parser('quantize', help='7-color quantization of a full panel image').set_defaults(func=bench_quantize)
+    render = subparsers.add_parser('render', help='both views with the chrome and native backends')
+    render.add_argument('--max-diff', type=float, default=0.25,
+                        help='fraction of ink pixels the native views may differ from Chrome by')
+    render.add_argument('--min-ink', type=float, default=0.02, help='fraction of pixels the native views must have in ink')
+    render.set_defaults(func=bench_render)
+    render_one = subparsers.add_parser('render-one', help='both views with a single backend, used by "render"')
+    render_one.add_argument('backend', choices=('chrome', 'native'))
+    render_one.add_argument('output', help='path prefix of the images to write')
+    render_one.add_argument('--source-templates', action='store_true', help='render the templates as they are, unbuilt')
+    render_one.set_defaults(func=bench_render_one)
+    subparsers.add_parser('templates', help='month view HTML with hundreds of events per day').set_defaults(
+        func=bench_templates)
+    subparsers.add_parser('spi', help='frame transfer to a fake DEV_Config backend').set_defaults(func=bench_spi)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
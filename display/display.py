@@ -5,54 +5,205 @@ This part of the code exposes functions to interface with the eink display
 """
 
 import display.epd13in3E as eink
-from PIL import Image
+import display.epdconfig as epdconfig
+from display.quantizer import Quantizer, PANEL_COLORS
+from display.emulator import EPDEmulator
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import datetime
+import hashlib
+import json
 import logging
+import os
+import pathlib
 
 
 class DisplayHelper:
 
-    def __init__(self, width, height):
+    def __init__(self, width, height, keep_frame=False, dither='diffusion', palette=None, busy_timeout=60,
+                 poll_strategy=eink.backoff_poll, backend='hardware'):
         # Initialise the display
         self.logger = logging.getLogger('maginkcal')
+        self.currPath = str(pathlib.Path(__file__).parent.absolute())
+        self.stateFile = self.currPath + '/last_frame.json'
+        self.frameFile = self.currPath + '/last_frame.bin'
+        self.keepFrame = keep_frame  # also store the packed frame on the SD card, so the fraction of changed pixels can be computed
         self.screenwidth = width
         self.screenheight = height
-        self.epd = eink.EPD()
+        if backend == 'emulator' and not isinstance(epdconfig.spi, EPDEmulator):
+            # no panel attached, show the image on an emulated one and save it to a file instead
+            epdconfig.use_emulator(output_file=self.currPath + '/emulator.png')
+        self.executor = None  # single worker thread that runs panel refreshes in the background
+        self.epd = eink.EPD(Quantizer(palette, dither), busy_timeout, poll_strategy)
         self.epd.Init()
+        self.asleep = False
 
-    def update(self, rgb_image):
+    def __enter__(self):
+        # Use as a context manager to show any number of frames and put the display to sleep once at the end
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.sleep()
+        return False
+
+    def load_state(self):
+        try:
+            with open(self.stateFile, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self, state):
+        with open(self.stateFile, 'w') as file:
+            json.dump(state, file)
+
+    def get_frame_change(self, buf):
+        """
+        Returns the fraction of pixels that differ between the packed frame and the one last shown on the display.
+        When only the digest of the last frame is known, any difference is reported as a full change.
+        """
+        if hashlib.sha256(buf).hexdigest() == self.load_state().get('digest'):
+            return 0.0
+
+        try:
+            with open(self.frameFile, 'rb') as file:
+                last_buf = file.read()
+        except OSError:
+            return 1.0
+        if len(last_buf) != len(buf):
+            return 1.0
+
+        # each byte holds two pixels, so count differing high and low nibbles separately
+        diff = np.frombuffer(buf, dtype=np.uint8) ^ np.frombuffer(last_buf, dtype=np.uint8)
+        changed = np.count_nonzero(diff & 0xF0) + np.count_nonzero(diff & 0x0F)
+        return changed / (2 * len(buf))
+
+    def is_shown(self, buf, view):
+        # True if buf is the frame that was last shown for view, e.g. 'day' or 'month'
+        return hashlib.sha256(buf).hexdigest() == self.load_state().get('views', {}).get(view)
+
+    def is_on_display(self, buf):
+        # True if buf is the frame the display still holds
+        return hashlib.sha256(buf).hexdigest() == self.load_state().get('digest')
+
+    def save_frame(self, buf, view=None):
+        # Records a refresh with buf, for view if given, in a single write of the state
+        state = self.load_state()
+        state['digest'] = hashlib.sha256(buf).hexdigest()
+        state['displayed'] = datetime.datetime.now().isoformat()
+        state['refreshesSinceCalibration'] = state.get('refreshesSinceCalibration', 0) + 1
+        if view is not None:
+            state.setdefault('views', {})[view] = state['digest']
+        self.save_state(state)
+
+        if self.keepFrame:
+            with open(self.frameFile, 'wb') as file:
+                file.write(buf)
+        elif os.path.exists(self.frameFile):
+            os.remove(self.frameFile)
+
+    def clear_frame(self):
+        # Forget the last frame, e.g. after the display has been overwritten with solid colors
+        state = self.load_state()
+        state.pop('digest', None)
+        self.save_state(state)
+        if os.path.exists(self.frameFile):
+            os.remove(self.frameFile)
+
+    def get_calibration_cycles(self, refreshes_per_cycle=14, max_cycles=3, max_days=7):
         """
-        Updates the display with a full-color image (PIL.Image).
-        The image will be quantized to the 7-color palette.
+        Picks the number of calibration cycles from the refresh history. Ghosting builds up with every refresh, so
+        one cycle is run per refreshes_per_cycle refreshes since the last calibration, up to max_cycles. A display that
+        was refreshed at all is still calibrated at least once every max_days.
+        """
+        state = self.load_state()
+        refreshes = state.get('refreshesSinceCalibration', 0)
+        cycles = min(max_cycles, refreshes // refreshes_per_cycle)
+
+        if cycles == 0 and refreshes > 0:
+            last_calibration = state.get('lastCalibration')
+            if last_calibration is None:
+                cycles = 1
+            elif datetime.datetime.now() - datetime.datetime.fromisoformat(last_calibration) >= datetime.timedelta(days=max_days):
+                cycles = 1
+
+        self.logger.info('{} refreshes since the last calibration, {} calibration cycles needed.'.format(refreshes, cycles))
+        return cycles
+
+    def prepare(self, rgb_image):
+        """
+        Quantizes a full-color image (PIL.Image) to the 7-color palette and packs it into a frame for show(). A frame
+        that is already packed, such as one downloaded from the render server, is returned as it is.
+        """
+        if isinstance(rgb_image, (bytes, bytearray)):
+            if len(rgb_image) != self.epd.width * self.epd.height // 2:
+                raise ValueError('Packed frame of {} bytes, expected {}'.format(len(rgb_image),
+                                                                                  self.epd.width * self.epd.height // 2))
+            return rgb_image
+        return self.epd.getbuffer(rgb_image)
+
+    def update(self, rgb_image, min_change=0.0, view=None):
+        """
+        Updates the display with a full-color image (PIL.Image), or a frame already packed, see prepare().
+        The image will be quantized to the 7-color palette. The refresh is skipped unless more than min_change
+        (fraction of pixels) differs from the frame already on the display. Returns the fraction of changed pixels.
+        view names what is shown, so that is_shown() can tell later whether it has changed since.
+        """
+        return self.show(self.prepare(rgb_image), min_change, view)
+
+    def update_async(self, rgb_image, min_change=0.0, view=None):
+        """
+        Same as update(), but runs in the background and returns a concurrent.futures.Future right away, so that
+        other work can carry on while the panel refreshes. Use asyncio.wrap_future() to await it from a coroutine.
+        The future raises TimeoutError if the panel stays busy for longer than busy_timeout.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='eink')
+        return self.executor.submit(self.update, rgb_image, min_change, view)
+
+    def show(self, buf, min_change=0.0, view=None):
+        """
+        Sends a frame packed by prepare() to the display, see update().
         """
 
         # self.epd.clear()
-        buf = self.epd.getbuffer(rgb_image)
+        change = self.get_frame_change(buf)
+        if change <= min_change:
+            self.logger.info('E-Ink display update skipped, {:.2%} of pixels changed.'.format(change))
+            return change
+
         self.epd.display(buf)
-        self.logger.info('E-Ink display update complete.')
+        self.save_frame(buf, view)
+        self.logger.info('E-Ink display update complete, {:.2%} of pixels changed.'.format(change))
+        return change
 
     def calibrate(self, cycles=1):
         """
         Cycles through solid colors to prevent ghosting.
         """
-        colors = [
-            (255, 255, 255),  # White
-            (0, 0, 0),        # Black
-            (255, 255, 0),    # Yellow
-            (255, 0, 0),      # Red
-            (0, 0, 255),      # Blue
-            (0, 255, 0),      # Green
-        ]
+        colors = ['white', 'black', 'yellow', 'red', 'blue', 'green']
         for _ in range(cycles):
             for color in colors:
-                image = Image.new("RGB", (self.screenwidth, self.screenheight), color)
-                buf = self.epd.getbuffer(image)
-                self.epd.display(buf)
+                # every pixel has the same color, so the packed frame is a single repeated byte
+                code = PANEL_COLORS[color]
+                self.epd.Clear((code << 4) | code)
+        self.clear_frame()
+
+        state = self.load_state()
+        state['refreshesSinceCalibration'] = 0
+        state['lastCalibration'] = datetime.datetime.now().isoformat()
+        self.save_state(state)
         self.logger.info('E-Ink display calibration complete.')
 
     def sleep(self):
         """
-        Puts the display into deep sleep.
+        Puts the display into deep sleep, once any refresh still running in the background is done.
         """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.asleep:
+            return
         self.epd.sleep()
+        self.asleep = True
         self.logger.info('E-Ink display entered deep sleep.')
-
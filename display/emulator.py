@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+An emulated 13.3" E panel that stands in for the DEV_Config shared library, so the whole display path can be run and
+profiled on a PC. It records the command/data stream sent to both controllers, rebuilds the image from the frame data
+written with command 0x10, and drives the BUSY pin from a simple timing model. By default time is simulated, so a
+refresh that takes 20 s on the real panel finishes instantly while still being accounted for in the clock.
+
+Select it by setting the MAGINKCAL_DISPLAY_BACKEND environment variable to "emulator", or "displayBackend" in
+config.json.
+"""
+
+import time
+import ctypes
+import numpy as np
+from PIL import Image
+
+import display.epdconfig as epdconfig
+from display.fake_devconfig import FakeDevConfig
+from display.quantizer import PANEL_COLORS, DEFAULT_PALETTE
+
+# Rough timings of the real panel, in seconds
+DEFAULT_TIMING = {
+    'reset': 0.05,          # BUSY low after the reset pin is released
+    0x04: 0.2,              # PON, power on
+    0x12: 20.0,             # DRF, full refresh
+    'spi_byte': 1e-6,       # per byte sent over SPI, about 8 MHz
+    'call': 20e-6,          # per call into the driver library (GPIO write, SPI transfer)
+}
+
+
+class SimulatedClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RealClock:
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class EPDEmulator(FakeDevConfig):
+
+    def __init__(self, timing=None, realtime=False, output_file=None, width=1200, height=1600):
+        super().__init__()
+        self.timing = dict(DEFAULT_TIMING)
+        self.timing.update(timing or {})
+        self.clock = RealClock() if realtime else SimulatedClock()
+        self.outputFile = output_file  # save the image shown after each refresh, e.g. to look at it
+        self.width = width
+        self.height = height
+
+        self.csPins = {epdconfig.EPD_CS_M_PIN: 'M', epdconfig.EPD_CS_S_PIN: 'S'}
+        self.selected = ()
+        self.command = None
+        self.stream = []  # (controllers, command, data) for each command sent
+        self.ram = {'M': bytearray(), 'S': bytearray()}
+        self.displayed = None  # packed frame shown by the last refresh
+        self.refreshes = 0
+        self.busyUntil = 0.0
+
+    def advance(self, seconds):
+        # Time spent by the driver itself only counts when time is simulated
+        if isinstance(self.clock, SimulatedClock):
+            self.clock.sleep(seconds)
+
+    def DEV_Digital_Write(self, pin, value):
+        self.advance(self.timing['call'])
+        previous = self.pins.get(pin)
+        super().DEV_Digital_Write(pin, value)
+
+        if pin in self.csPins:
+            # the first byte after a chip select goes low is a command, the rest is data for it
+            self.selected = tuple(name for cs, name in self.csPins.items() if self.pins.get(cs) == 0)
+            self.command = None
+        elif pin == epdconfig.EPD_RST_PIN and previous == 0 and value == 1:
+            self.busyUntil = self.clock.monotonic() + self.timing['reset']
+
+    def DEV_Digital_Read(self, pin):
+        self.advance(self.timing['call'])
+        if pin == epdconfig.EPD_BUSY_PIN:
+            return 0 if self.clock.monotonic() < self.busyUntil else 1  # 0: busy, 1: idle
+        return self.pins.get(pin, 0)
+
+    def DEV_SPI_SendData(self, value):
+        self.advance(self.timing['call'] + self.timing['spi_byte'])
+        super().DEV_SPI_SendData(value)
+        if self.command is None:
+            self.start_command(value)
+        else:
+            self.write_data(bytes((value,)))
+
+    def DEV_SPI_SendData_nByte(self, array_data, length):
+        if isinstance(length, ctypes.c_ulong):
+            length = length.value
+        self.advance(self.timing['call'] + self.timing['spi_byte'] * length)
+        super().DEV_SPI_SendData_nByte(array_data, length)
+        data = ctypes.string_at(array_data, length)
+        if self.command is None:
+            self.start_command(data[0])
+            data = data[1:]
+        self.write_data(data)
+
+    def start_command(self, command):
+        self.command = command
+        self.stream.append((self.selected, command, bytearray()))
+        if command == 0x10:
+            for name in self.selected:
+                self.ram[name] = bytearray()
+        elif command == 0x12:
+            self.refresh()
+        if command in self.timing:
+            self.busyUntil = self.clock.monotonic() + self.timing[command]
+
+    def write_data(self, data):
+        self.stream[-1][2].extend(data)
+        if self.command == 0x10:
+            for name in self.selected:
+                self.ram[name].extend(data)
+
+    def get_frame(self):
+        """
+        Returns the packed frame currently held in the controllers' memory, rows of the master controller's half
+        followed by the slave controller's half, in the same layout as EPD.getbuffer.
+        """
+        half = self.width // 4
+        size = half * self.height
+        master = np.frombuffer(bytes(self.ram['M'][:size]).ljust(size, b'\x11'), dtype=np.uint8)
+        slave = np.frombuffer(bytes(self.ram['S'][:size]).ljust(size, b'\x11'), dtype=np.uint8)
+        return np.hstack((master.reshape(self.height, half), slave.reshape(self.height, half))).tobytes()
+
+    def refresh(self):
+        self.displayed = self.get_frame()
+        self.refreshes += 1
+        if self.outputFile:
+            self.get_image().save(self.outputFile)
+
+    def get_image(self):
+        """
+        Returns the image shown by the last refresh as a PIL RGB image.
+        """
+        colors = np.zeros((16, 3), dtype=np.uint8)
+        for name, code in PANEL_COLORS.items():
+            colors[code] = DEFAULT_PALETTE[name]
+
+        frame = np.frombuffer(self.displayed or self.get_frame(), dtype=np.uint8)
+        pixels = np.empty(frame.size * 2, dtype=np.uint8)
+        pixels[0::2] = frame >> 4
+        pixels[1::2] = frame & 0x0F
+        return Image.fromarray(colors[pixels].reshape(self.height, self.width, 3), 'RGB')
@@ -26,20 +26,73 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 #
-import time
 import display.epdconfig as epdconfig
+from display.quantizer import Quantizer
 
-import PIL
-from PIL import Image
-import io
+import numpy as np
 
 EPD_WIDTH       = 1200
 EPD_HEIGHT      = 1600
 
+# Chip selects a command is sent to: the master controller only, or both controllers at once
+CS_M    = 'M'
+CS_ALL  = 'ALL'
+
+# (chip select, command, data) for each step of the init sequence
+INIT_SEQUENCE = (
+    (CS_M,   0x74, (0xC0, 0x1C, 0x1C, 0xCC, 0xCC, 0xCC, 0x15, 0x15, 0x55)),
+    (CS_ALL, 0xF0, (0x49, 0x55, 0x13, 0x5D, 0x05, 0x10)),
+    (CS_ALL, 0x00, (0xDF, 0x69)),
+    (CS_ALL, 0x50, (0xF7,)),
+    (CS_ALL, 0x60, (0x03, 0x03)),
+    (CS_ALL, 0x86, (0x10,)),
+    (CS_ALL, 0xE3, (0x22,)),
+    (CS_ALL, 0xE0, (0x01,)),
+    (CS_ALL, 0x61, (0x04, 0xB0, 0x03, 0x20)),
+    (CS_M,   0x01, (0x0F, 0x00, 0x28, 0x2C, 0x28, 0x38)),
+    (CS_M,   0xB6, (0x07,)),
+    (CS_M,   0x06, (0xE8, 0x28)),
+    (CS_M,   0xB7, (0x01,)),
+    (CS_M,   0x05, (0xE8, 0x28)),
+    (CS_M,   0xB0, (0x01,)),
+    (CS_M,   0xB1, (0x02,)),
+)
+POWER_ON        = ((CS_ALL, 0x04, ()),)         # PON
+DISPLAY_REFRESH = ((CS_ALL, 0x12, (0x00,)),)    # DRF
+POWER_OFF       = ((CS_ALL, 0x02, (0x00,)),)    # POF
+DEEP_SLEEP      = ((CS_ALL, 0x07, (0xA5,)),)
+
+def compile_sequence(sequence):
+    # The controller takes the first byte after its chip select goes low as the command,
+    # so each command and its data can go out in a single SPI transfer
+    return tuple((cs, bytearray((command,) + data)) for cs, command, data in sequence)
+
+# Poll strategies for ReadBusyH, each yields the delay in ms before the next read of the BUSY pin
+def fixed_poll(interval_ms=5):
+    while True:
+        yield interval_ms
+
+def backoff_poll(initial_ms=5, max_ms=100, factor=2):
+    interval_ms = initial_ms
+    while True:
+        yield interval_ms
+        interval_ms = min(interval_ms * factor, max_ms)
+
 class EPD():
-    def __init__(self):
+    INIT_SEQUENCE   = compile_sequence(INIT_SEQUENCE)
+    POWER_ON        = compile_sequence(POWER_ON)
+    DISPLAY_REFRESH = compile_sequence(DISPLAY_REFRESH)
+    POWER_OFF       = compile_sequence(POWER_OFF)
+    DEEP_SLEEP      = compile_sequence(DEEP_SLEEP)
+
+    ready = False   # the controller has been initialised in this process and is not in deep sleep
+
+    def __init__(self, quantizer=None, busy_timeout=None, poll_strategy=fixed_poll):
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        self.quantizer = quantizer or Quantizer()
+        self.busyTimeout = busy_timeout     # seconds, None waits forever
+        self.pollStrategy = poll_strategy
 
         self.BLACK  = 0x000000   #   0000  BGR
         self.WHITE  = 0xffffff   #   0001
@@ -60,15 +113,15 @@ class EPD():
     
     def Reset(self):
         epdconfig.digital_write(self.EPD_RST_PIN, 1) 
-        time.sleep(0.03) 
+        epdconfig.delay_ms(30) 
         epdconfig.digital_write(self.EPD_RST_PIN, 0) 
-        time.sleep(0.03) 
+        epdconfig.delay_ms(30) 
         epdconfig.digital_write(self.EPD_RST_PIN, 1) 
-        time.sleep(0.03) 
+        epdconfig.delay_ms(30) 
         epdconfig.digital_write(self.EPD_RST_PIN, 0) 
-        time.sleep(0.03) 
+        epdconfig.delay_ms(30) 
         epdconfig.digital_write(self.EPD_RST_PIN, 1) 
-        time.sleep(0.03) 
+        epdconfig.delay_ms(30) 
 
     def CS_ALL(self, Value):
         epdconfig.digital_write(self.EPD_CS_M_PIN, Value)
@@ -83,153 +136,60 @@ class EPD():
     def SendData2(self, buf, Len):
         epdconfig.spi_writebyte2(buf, Len)
 
+    def SendBuffer(self, buf):
+        epdconfig.spi_writebuf(buf)
+
     def ReadBusyH(self):
         print("e-Paper busy H")
+        deadline = None if self.busyTimeout is None else epdconfig.monotonic() + self.busyTimeout
+        delays = self.pollStrategy()
         while(epdconfig.digital_read(self.EPD_BUSY_PIN) == 0):      # 0: busy, 1: idle
-            epdconfig.delay_ms(5)
+            if deadline is not None and epdconfig.monotonic() > deadline:
+                raise TimeoutError("e-Paper still busy after %s s" % self.busyTimeout)
+            epdconfig.delay_ms(next(delays))
         print("e-Paper busy H release")
 
+    def SendSequence(self, sequence):
+        for cs, packet in sequence:
+            if cs == CS_ALL:
+                self.CS_ALL(0)
+            else:
+                epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
+            epdconfig.spi_writebuf(packet)
+            self.CS_ALL(1)
+
     def TurnOnDisplay(self):
         print("Write PON")
-        self.CS_ALL(0)
-        self.SendCommand(0x04)
-        self.CS_ALL(1)
+        self.SendSequence(self.POWER_ON)
         self.ReadBusyH()
 
         epdconfig.delay_ms(50)
 
         print("Write DRF")
-        self.CS_ALL(0)
-        self.SendCommand(0x12)
-        self.SendData(0x00)
-        self.CS_ALL(1)
+        self.SendSequence(self.DISPLAY_REFRESH)
         self.ReadBusyH()
 
         print("Write POF")
-        self.CS_ALL(0)
-        self.SendCommand(0x02)
-        self.SendData(0x00)
-        self.CS_ALL(1)
+        self.SendSequence(self.POWER_OFF)
         print("Display Done!!")
 
-    def Init(self):
+    def Init(self, force=False):
+        # The controller keeps its settings until it is put into deep sleep, so
+        # there is no need to reset it again if it was initialised before
+        if EPD.ready and not force:
+            print("EPD already initialized")
+            return
+
         print("EPD init...")
         epdconfig.module_init()
         
         self.Reset() 
         self.ReadBusyH()
 
-        epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
-        self.SendCommand(0x74)
-        self.SendData(0xC0)
-        self.SendData(0x1C)
-        self.SendData(0x1C)
-        self.SendData(0xCC)
-        self.SendData(0xCC)
-        self.SendData(0xCC)
-        self.SendData(0x15)
-        self.SendData(0x15)
-        self.SendData(0x55)
-        self.CS_ALL(1)
-
-        self.CS_ALL(0)
-        self.SendCommand(0xF0)
-        self.SendData(0x49)
-        self.SendData(0x55)
-        self.SendData(0x13)
-        self.SendData(0x5D)
-        self.SendData(0x05)
-        self.SendData(0x10)
-        self.CS_ALL(1)
-
-        self.CS_ALL(0)
-        self.SendCommand(0x00)
-        self.SendData(0xDF)
-        self.SendData(0x69)
-        self.CS_ALL(1)
-
-        self.CS_ALL(0)
-        self.SendCommand(0x50)
-        self.SendData(0xF7)
-        self.CS_ALL(1)
-
-        self.CS_ALL(0)
-        self.SendCommand(0x60)
-        self.SendData(0x03)
-        self.SendData(0x03)
-        self.CS_ALL(1)
-
-        self.CS_ALL(0)
-        self.SendCommand(0x86)
-        self.SendData(0x10)
-        self.CS_ALL(1)
-
-        self.CS_ALL(0)
-        self.SendCommand(0xE3)
-        self.SendData(0x22)
-        self.CS_ALL(1)
-
-        self.CS_ALL(0)
-        self.SendCommand(0xE0)
-        self.SendData(0x01)
-        self.CS_ALL(1)
-
-        self.CS_ALL(0)
-        self.SendCommand(0x61)
-        self.SendData(0x04)
-        self.SendData(0xB0)
-        self.SendData(0x03)
-        self.SendData(0x20)
-        self.CS_ALL(1)
-
-        epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
-        self.SendCommand(0x01)
-        self.SendData(0x0F)
-        self.SendData(0x00)
-        self.SendData(0x28)
-        self.SendData(0x2C)
-        self.SendData(0x28)
-        self.SendData(0x38)
-        self.CS_ALL(1)
-
-        epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
-        self.SendCommand(0xB6)
-        self.SendData(0x07)
-        self.CS_ALL(1)
-
-        epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
-        self.SendCommand(0x06)
-        self.SendData(0xE8)
-        self.SendData(0x28)
-        self.CS_ALL(1)
-
-        epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
-        self.SendCommand(0xB7)
-        self.SendData(0x01)
-        self.CS_ALL(1)
-
-        epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
-        self.SendCommand(0x05)
-        self.SendData(0xE8)
-        self.SendData(0x28)
-        self.CS_ALL(1)
-
-        epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
-        self.SendCommand(0xB0)
-        self.SendData(0x01)
-        self.CS_ALL(1)
-
-        epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
-        self.SendCommand(0xB1)
-        self.SendData(0x02)
-        self.CS_ALL(1)
+        self.SendSequence(self.INIT_SEQUENCE)
+        EPD.ready = True
     
     def getbuffer(self, image):
-        # Create a pallette with the 7 colors supported by the panel
-        pal_image = Image.new("P", (1,1))
-        pal_image.putpalette( (0,0,0,  255,255,255,  255,255,0,  255,0,0,  0,0,0,  0,0,255,  0,255,0) + (0,0,0)*249)
-        # pal_image.putpalette( (0,0,0,  255,255,255,  0,255,0,   0,0,255,  255,0,0,  255,255,0, 255,128,0) + (0,0,0)*249)
-
         # Check if we need to rotate the image
         imwidth, imheight = image.size
         if(imwidth == self.width and imheight == self.height):
@@ -240,56 +200,63 @@ class EPD():
             print("Invalid image dimensions: %d x %d, expected %d x %d" % (imwidth, imheight, self.width, self.height))
 
         # Convert the soruce image to the 7 colors, dithering if needed
-        image_7color = image_temp.convert("RGB").quantize(palette=pal_image)
-        buf_7color = bytearray(image_7color.tobytes('raw'))
+        buf_7color = self.quantizer.quantize(image_temp)
+
+        return self.packbuffer(buf_7color)
 
+    def packbuffer(self, buf_7color):
         # PIL does not support 4 bit color, so pack the 4 bits of color
-        # into a single byte to transfer to the panel
-        buf = [0x00] * int(self.width * self.height / 2)
-        idx = 0
-        for i in range(0, len(buf_7color), 2):
-            buf[idx] = (buf_7color[i] << 4) + buf_7color[i+1]
-            idx += 1
-            
-        return buf
+        # into a single byte to transfer to the panel. Every even pixel goes
+        # into the high nibble and the following odd pixel into the low nibble.
+        pixels = np.frombuffer(buf_7color, dtype=np.uint8)
+        packed = (pixels[0::2] << 4) | pixels[1::2]
+
+        return bytearray(packed)
     
     def Clear(self, color=0x11):
+        # color is a packed byte, i.e. the same 4-bit color in both nibbles. Both
+        # controllers get the same constant half frame, streamed in bulk.
+        buf = bytearray((color,)) * (int(self.width / 4) * self.height)
+
         epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
         self.SendCommand(0x10)
-        for i in range(self.height):
-            self.SendData2([color]* int(self.width/2), int(self.width/2))
+        self.SendBuffer(buf)
         self.CS_ALL(1)
         epdconfig.digital_write(self.EPD_CS_S_PIN, 0)
         self.SendCommand(0x10)
-        for i in range(self.height):
-            self.SendData2([color]* int(self.width/2), int(self.width/2))
+        self.SendBuffer(buf)
         self.CS_ALL(1)
 
         self.TurnOnDisplay()
 
-    def display(self, image):
+    def splitbuffer(self, image):
+        # Each row of the packed frame holds the left half for the master controller
+        # followed by the right half for the slave controller. Split them once into
+        # two contiguous buffers so each can be streamed to its controller in bulk.
         Width =int(self.width / 4)
         Width1 =int(self.width / 2)
 
+        frame = np.frombuffer(image, dtype=np.uint8).reshape(self.height, Width1)
+        return np.ascontiguousarray(frame[:, :Width]), np.ascontiguousarray(frame[:, Width:])
+
+    def display(self, image):
+        buf_m, buf_s = self.splitbuffer(image)
+
         epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
         self.SendCommand(0x10)
-        for i in range(self.height):
-            self.SendData2(image[i * Width1 : i * Width1+Width], Width)
+        self.SendBuffer(buf_m)
         self.CS_ALL(1)
 
         epdconfig.digital_write(self.EPD_CS_S_PIN, 0)
         self.SendCommand(0x10)
-        for i in range(self.height):
-            self.SendData2(image[i * Width1+Width : i * Width1+Width1], Width)
+        self.SendBuffer(buf_s)
         self.CS_ALL(1)
 
         self.TurnOnDisplay()
 
     def sleep(self):
-        self.CS_ALL(0)
-        self.SendCommand(0x07)
-        self.SendData(0XA5)
-        self.CS_ALL(1)
+        self.SendSequence(self.DEEP_SLEEP)
+        EPD.ready = False
 
         epdconfig.delay_ms(2000)
         epdconfig.module_exit()
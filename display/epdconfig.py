@@ -28,7 +28,9 @@
 #
 import time
 import os
+import json
 import logging
+import struct
 import sys
 
 from ctypes import *
@@ -45,53 +47,116 @@ EPD_DC_PIN      =25
 EPD_RST_PIN     =17
 EPD_BUSY_PIN    =24
 EPD_PWR_PIN     =18
+
+# Largest number of bytes handed to the driver in a single call when streaming a frame
+SPI_CHUNK_SIZE  =4096
  
 find_dirs = [
     os.path.dirname(os.path.realpath(__file__)),
     '/usr/local/lib',
     '/usr/lib',
 ]
-spi = None
-for find_dir in find_dirs:
-    val = int(os.popen('getconf LONG_BIT').read())
-    val_1 = os.popen("cat /proc/cpuinfo | grep 'Raspberry Pi 5'").read()
-    if val == 64:
-        if val_1 == "":
-            so_filename = os.path.join(find_dir, 'DEV_Config_64_b.so')
-        else:
-            so_filename = os.path.join(find_dir, 'DEV_Config_64_w.so')
-    else:
-        if val_1 == "":
-            so_filename = os.path.join(find_dir, 'DEV_Config_32_b.so')
-        else:
-            so_filename = os.path.join(find_dir, 'DEV_Config_32_w.so')
-    if os.path.exists(so_filename):
-        spi = CDLL(so_filename)
-        break
-if spi is None:
+# Remembers which DEV_Config library was found, so the search is done once and not on every boot.
+# Delete it when moving the SD card to a different board.
+LIBRARY_CACHE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), '.devconfig_cache.json')
+
+spi = None      # loaded on first use, see get_backend()
+clock = None    # set for backends that keep their own, possibly simulated, time
+
+def get_library_name():
+    # The library is built per word size of the userland, with a separate build for the Raspberry Pi 5
+    is_64bit = struct.calcsize('P') == 8
+    try:
+        with open('/proc/cpuinfo', 'r') as cpuinfo:
+            is_pi5 = 'Raspberry Pi 5' in cpuinfo.read()
+    except OSError:
+        is_pi5 = False
+    return 'DEV_Config_%d_%s.so' % (64 if is_64bit else 32, 'w' if is_pi5 else 'b')
+
+def find_library():
+    try:
+        with open(LIBRARY_CACHE_FILE, 'r') as cache_file:
+            so_filename = json.load(cache_file)['so_filename']
+        if os.path.exists(so_filename):
+            return so_filename
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    so_name = get_library_name()
+    for find_dir in find_dirs:
+        so_filename = os.path.join(find_dir, so_name)
+        if os.path.exists(so_filename):
+            try:
+                with open(LIBRARY_CACHE_FILE, 'w') as cache_file:
+                    json.dump({'so_filename': so_filename}, cache_file)
+            except OSError:
+                pass
+            return so_filename
+    raise RuntimeError('Cannot find %s in %s' % (so_name, ', '.join(find_dirs)))
 
-    RuntimeError('Cannot find DEV_Config.so')
+def get_backend():
+    # Load the DEV_Config library the first time the hardware is used, unless another backend was set
+    global spi
+    if spi is None:
+        spi = CDLL(find_library())
+    return spi
+
+def use_backend(backend):
+    # Swap the DEV_Config library for any object exposing the same DEV_* functions, e.g. FakeDevConfig
+    global spi, clock
+    spi = backend
+    clock = getattr(backend, 'clock', None)
+
+def use_emulator(**kwargs):
+    # Swap the DEV_Config library for an emulated panel, see display/emulator.py
+    from display.emulator import EPDEmulator
+    emulator = EPDEmulator(**kwargs)
+    use_backend(emulator)
+    return emulator
 
 def digital_write(pin, value):
-    spi.DEV_Digital_Write(pin, value)
+    get_backend().DEV_Digital_Write(pin, value)
 
 def digital_read(pin):
-    return spi.DEV_Digital_Read(pin)
+    return get_backend().DEV_Digital_Read(pin)
 
 def spi_writebyte(value): 
-    spi.DEV_SPI_SendData(value)
+    get_backend().DEV_SPI_SendData(value)
 
 def spi_writebyte2(buf, len): 
     array_data = (ctypes.c_ubyte * len)(*buf)
-    spi.DEV_SPI_SendData_nByte(array_data, ctypes.c_ulong(len))
+    get_backend().DEV_SPI_SendData_nByte(array_data, ctypes.c_ulong(len))
+
+def spi_writebuf(buf, chunk_size=SPI_CHUNK_SIZE):
+    # Stream any buffer-protocol object (bytes, bytearray, memoryview, NumPy array) in large chunks.
+    # The ctypes arrays are views on the caller's memory, so nothing is copied unless the buffer is read-only.
+    backend = get_backend()
+    data = memoryview(buf).cast('B')
+    if data.readonly:
+        data = memoryview(bytearray(data))
+    for offset in range(0, len(data), chunk_size):
+        length = min(chunk_size, len(data) - offset)
+        array_data = (ctypes.c_ubyte * length).from_buffer(data, offset)
+        backend.DEV_SPI_SendData_nByte(array_data, ctypes.c_ulong(length))
  
 def delay_ms(delaytime):
-    time.sleep(delaytime / 1000.0)
+    if clock is not None:
+        clock.sleep(delaytime / 1000.0)
+    else:
+        time.sleep(delaytime / 1000.0)
+
+def monotonic():
+    if clock is not None:
+        return clock.monotonic()
+    return time.monotonic()
         
 def module_init():
-    spi.DEV_ModuleInit()
+    get_backend().DEV_ModuleInit()
 
 def module_exit():
-    spi.DEV_ModuleExit()
+    get_backend().DEV_ModuleExit()
+
+if os.environ.get('MAGINKCAL_DISPLAY_BACKEND', '').lower() == 'emulator':
+    use_emulator(output_file=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'emulator.png'))
 
   
\ No newline at end of file
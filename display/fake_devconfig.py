@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A stand-in for the Waveshare DEV_Config shared library, exposing the same DEV_* functions that epdconfig calls. It
+does not talk to any hardware, it only counts what would have been sent, so the SPI path can be exercised and timed
+on a PC. Install it with epdconfig.use_backend(FakeDevConfig()).
+"""
+
+import ctypes
+
+
+class FakeDevConfig:
+
+    def __init__(self):
+        self.pins = {}
+        self.bytes_sent = 0
+        self.transfers = 0
+
+    def DEV_ModuleInit(self):
+        return 0
+
+    def DEV_ModuleExit(self):
+        return 0
+
+    def DEV_Digital_Write(self, pin, value):
+        self.pins[pin] = value
+
+    def DEV_Digital_Read(self, pin):
+        # The BUSY pin reads 1 (idle) so that the driver never waits on the fake panel
+        return 1
+
+    def DEV_SPI_SendData(self, value):
+        self.bytes_sent += 1
+        self.transfers += 1
+
+    def DEV_SPI_SendData_nByte(self, array_data, length):
+        if isinstance(length, ctypes.c_ulong):
+            length = length.value
+        self.bytes_sent += length
+        self.transfers += 1
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This part of the code maps full-color images onto the colors the 13.3" E panel can show. Colors are looked up in a
+precomputed RGB to panel color table, which is cached on disk, instead of searching the palette for every pixel. The
+palette can be replaced with the colors measured off an actual panel, which are noticeably duller than pure RGB.
+"""
+
+import hashlib
+import logging
+import os
+import pathlib
+import numpy as np
+from PIL import Image
+
+# Panel color index (as sent to the controller) for each color the panel can show. Index 4 is not used by the panel.
+PANEL_COLORS = {
+    'black': 0,
+    'white': 1,
+    'yellow': 2,
+    'red': 3,
+    'blue': 5,
+    'green': 6,
+}
+
+# Idealised RGB values, matching the palette the panel driver has always used
+DEFAULT_PALETTE = {
+    'black': (0, 0, 0),
+    'white': (255, 255, 255),
+    'yellow': (255, 255, 0),
+    'red': (255, 0, 0),
+    'blue': (0, 0, 255),
+    'green': (0, 255, 0),
+}
+
+# Panel color index of each of the idealised colors, to recognise images drawn in the panel's own colors
+EXACT_COLORS = {rgb: PANEL_COLORS[name] for name, rgb in DEFAULT_PALETTE.items()}
+
+DITHER_MODES = ('none', 'ordered', 'diffusion')
+
+# 4x4 Bayer matrix, normalised to thresholds in [-0.5, 0.5)
+BAYER_4X4 = (np.array([
+    [0, 8, 2, 10],
+    [12, 4, 14, 6],
+    [3, 11, 1, 9],
+    [15, 7, 13, 5],
+], dtype=np.float32) + 0.5) / 16 - 0.5
+
+
+class Quantizer:
+
+    def __init__(self, palette=None, dither='diffusion', lut_bits=6, ordered_spread=64, cache_dir=None):
+        self.logger = logging.getLogger('maginkcal')
+        if dither not in DITHER_MODES:
+            raise ValueError('Unknown dither mode "{}", expected one of {}'.format(dither, ', '.join(DITHER_MODES)))
+
+        self.palette = dict(DEFAULT_PALETTE)
+        if palette:
+            self.palette.update({name.lower(): tuple(rgb) for name, rgb in palette.items()})
+        unknown = set(self.palette) - set(PANEL_COLORS)
+        if unknown:
+            raise ValueError('Unknown panel colors in palette: {}'.format(', '.join(sorted(unknown))))
+
+        self.dither = dither
+        self.lutBits = lut_bits
+        self.orderedSpread = ordered_spread
+        self.cacheDir = cache_dir or str(pathlib.Path(__file__).parent.absolute()) + '/cache'
+        self.codes = np.array([PANEL_COLORS[name] for name in self.palette], dtype=np.uint8)
+        self.colors = np.array([self.palette[name] for name in self.palette], dtype=np.int32)
+        self.lut = None
+        self.palImage = None
+
+    def get_palette_image(self):
+        # Palette image for PIL, laid out so that the palette index of each color equals its panel color index
+        if self.palImage is None:
+            entries = [self.palette['black']] * 256
+            for name, rgb in self.palette.items():
+                entries[PANEL_COLORS[name]] = rgb
+            self.palImage = Image.new("P", (1, 1))
+            self.palImage.putpalette([value for rgb in entries for value in rgb])
+        return self.palImage
+
+    def get_lut(self):
+        """
+        Returns the table mapping each RGB color, reduced to lut_bits per channel, to the nearest panel color index.
+        The table is built once per palette and kept on disk, so later runs only need to load it.
+        """
+        if self.lut is not None:
+            return self.lut
+
+        key = hashlib.sha1(repr((self.lutBits, sorted(self.palette.items()))).encode()).hexdigest()[:16]
+        lut_file = os.path.join(self.cacheDir, 'lut_{}.npy'.format(key))
+        try:
+            self.lut = np.load(lut_file)
+            return self.lut
+        except (OSError, ValueError):
+            pass
+
+        # sample each bin at its center and pick the closest palette color
+        levels = 1 << self.lutBits
+        centers = (np.arange(levels, dtype=np.int32) << (8 - self.lutBits)) + (1 << (8 - self.lutBits) >> 1)
+        r, g, b = np.meshgrid(centers, centers, centers, indexing='ij')
+        grid = np.stack((r.ravel(), g.ravel(), b.ravel()), axis=1)
+        dist = ((grid[:, None, :] - self.colors[None, :, :]) ** 2).sum(axis=2)
+        self.lut = self.codes[np.argmin(dist, axis=1)]
+
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            tmp_file = lut_file + '.tmp.npy'
+            np.save(tmp_file, self.lut)
+            os.replace(tmp_file, lut_file)
+        except OSError as e:
+            self.logger.info('Unable to cache color lookup table: {}'.format(e))
+        return self.lut
+
+    def lookup(self, rgb):
+        # rgb is a (height, width, 3) uint8 array
+        shift = 8 - self.lutBits
+        rgb = rgb >> shift
+        idx = (rgb[..., 0].astype(np.int32) << (2 * self.lutBits)) | (rgb[..., 1].astype(np.int32) << self.lutBits) | rgb[..., 2]
+        return self.get_lut()[idx]
+
+    def get_exact_codes(self, image):
+        """
+        Returns the panel color indices of an image that only uses the idealised panel colors, such as one rendered
+        with isPaletteNative, or None if the image has any other color in it and has to be quantized. Such an image
+        needs neither dithering nor the palette measured off the panel, each pixel already says which color it is.
+        """
+        if image.mode == 'P':
+            # map the palette entries used by the image straight to panel colors
+            palette = image.getpalette() or []
+            table = np.zeros(256, dtype=np.uint8)
+            for _, index in image.getcolors(256):
+                code = EXACT_COLORS.get(tuple(palette[3 * index:3 * index + 3]))
+                if code is None:
+                    return None
+                table[index] = code
+            return table[np.asarray(image, dtype=np.uint8)]
+
+        if image.mode == 'RGB':
+            # getcolors gives up as soon as there are more colors than the panel has
+            colors = image.getcolors(len(EXACT_COLORS))
+            if colors is None or any(rgb not in EXACT_COLORS for _, rgb in colors):
+                return None
+            rgb = np.asarray(image, dtype=np.uint8)
+            key = (rgb[..., 0].astype(np.int32) << 16) | (rgb[..., 1].astype(np.int32) << 8) | rgb[..., 2]
+            codes = np.empty(key.shape, dtype=np.uint8)
+            for _, (r, g, b) in colors:
+                codes[key == ((r << 16) | (g << 8) | b)] = EXACT_COLORS[(r, g, b)]
+            return codes
+
+        return None
+
+    def quantize(self, image):
+        """
+        Converts a PIL image to a (height, width) uint8 array of panel color indices. Images that only use the
+        panel's own colors are mapped directly, without quantizing them.
+        """
+        codes = self.get_exact_codes(image)
+        if codes is not None:
+            return codes
+
+        image = image.convert("RGB")
+
+        if self.dither == 'diffusion':
+            # Floyd-Steinberg error diffusion is inherently sequential, so leave it to PIL's C implementation
+            image_7color = image.quantize(palette=self.get_palette_image())
+            return np.asarray(image_7color, dtype=np.uint8)
+
+        rgb = np.asarray(image, dtype=np.uint8)
+        if self.dither == 'ordered':
+            height, width = rgb.shape[:2]
+            offset = np.rint(BAYER_4X4 * self.orderedSpread).astype(np.int16)
+            offset = np.tile(offset, (height // 4 + 1, width // 4 + 1))[:height, :width, None]
+            rgb = np.clip(rgb + offset, 0, 255).astype(np.uint8)
+        return self.lookup(rgb)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This part of the code sorts the events retrieved for the month view by the days they fall on, so that the month view
+and the day view can both be made from the one fetch of the calendars, the days of the day view being within the
+month view. Events within a day are sorted by start, as retrieve_events returns them, and an event that goes over
+several days is on every one of them.
+
+Each day has the positions of its events in a bucket, filled in one pass over the events in order of start, so the
+index takes time in proportion to the events plus the days that the multi-day events go over, and a day is looked up
+without going through any event that is not on it.
+"""
+
+import datetime as dt
+
+
+class EventIndex:
+
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda k: k['startDatetime'])
+        self.days = {}  # positions in events of the events on each day, in order of start
+        for position, event in enumerate(self.events):
+            start = event['startDatetime']
+            # an event ending at midnight ends at the end of the day before, which is before the start of one that
+            # lasts no time at all, such an event is still on its start
+            end = max(start, event['endDatetime'])
+            for day in range((end.date() - start.date()).days + 1):
+                self.days.setdefault(start.date() + dt.timedelta(days=day), []).append(position)
+
+    def get_day(self, date):
+        # Returns the events that are on date, including those that started on an earlier day and are still going
+        return [self.events[position] for position in self.days.get(date, ())]
+
+    def get_days(self, start_date, num_days):
+        # Returns a list of the events on each of num_days days from start_date
+        return [self.get_day(start_date + dt.timedelta(days=i)) for i in range(num_days)]
@@ -3,6 +3,14 @@
 """
 This is where we retrieve events from the Google Calendar. Before doing so, make sure you have both the
 credentials.json and token.pickle in the same folder as this file. If not, run quickstart.py first.
+
+With an EventStore, the events are synced incrementally: each calendar is downloaded in full once, and after that only
+the events that changed since the previous sync are, see sync_events.
+
+The calendars are fetched at the same time, each on a thread with its own HTTP connection, since httplib2 connections
+cannot be shared between threads. A calendar that cannot be fetched is left out, without holding up the others.
+Every page of a calendar is followed, asking only for the fields of the events that are shown, and its events are
+converted page by page as they come in.
 """
 
 from __future__ import print_function
@@ -10,19 +18,43 @@ import datetime as dt
 import pickle
 import os.path
 import pathlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httplib2
+import google_auth_httplib2
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from gcal.eventindex import EventIndex
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 import logging
 
+# A full sync covers this much more than the month view, so that the following boots can keep syncing incrementally
+# until the month view has moved past it
+SYNC_WINDOW_PADDING = dt.timedelta(days=28)
+
+# Only the fields that are shown of each event are asked for, instead of the dozens the Calendar API returns by default
+EVENT_FIELDS = 'nextPageToken,nextSyncToken,items(id,status,summary,location,description,updated,start,end)'
+# Events on each page, the Calendar API defaults to 250 and returns at most 2500
+EVENTS_PER_PAGE = 1000
+
 
 class GcalHelper:
 
-    def __init__(self):
+    def __init__(self, service=None, store=None, max_workers=4):
         self.logger = logging.getLogger('maginkcal')
+        self.currPath = str(pathlib.Path(__file__).parent.absolute())
+        self.store = store  # EventStore to sync the calendars incrementally, None to download the whole window each time
+        self.maxWorkers = max_workers  # calendars fetched at the same time
+        self.credentials = None
+        self.threadLocal = threading.local()  # HTTP connection of each thread fetching calendars
+        # The Calendar API service, a different one can be passed in, e.g. pointing at another server
+        self.service = service or self.get_service()
+
+    def get_service(self):
         # Initialise the Google Calendar using the provided credentials and token
         SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
-        self.currPath = str(pathlib.Path(__file__).parent.absolute())
 
         creds = None
         # The file token.pickle stores the user's access and refresh tokens, and is
@@ -43,7 +75,8 @@ class GcalHelper:
             with open(self.currPath + '/token.pickle', 'wb') as token:
                 pickle.dump(creds, token)
 
-        self.service = build('calendar', 'v3', credentials=creds, cache_discovery=False)
+        self.credentials = creds
+        return build('calendar', 'v3', credentials=creds, cache_discovery=False)
 
     def list_calendars(self):
         # helps to retrieve ID for calendars within the account
@@ -102,26 +135,123 @@ class GcalHelper:
         return datetime_str
 
     def get_events(self, currDate, calendars, calStartDatetime, calEndDatetime, displayTZ, numDays, thresholdHours):
+        # Returns a list of the events on each of numDays days from currDate, multi-day events on every day they are on
         monthCalEventList = self.retrieve_events(calendars, calStartDatetime, calEndDatetime, displayTZ, thresholdHours)
+        return EventIndex(monthCalEventList).get_days(currDate, numDays)
 
-        # check if event stretches across multiple days
-        dayCalEventList = []
-        for i in range(numDays):
-            dayCalEventList.append([])
-        for event in monthCalEventList:
-            idx = self.get_day_in_cal(currDate, event['startDatetime'].date())
-            if event['isMultiday']:
-                end_idx = self.get_day_in_cal(currDate, event['endDatetime'].date())
-                if idx < 0:
-                    idx = 0
-                if end_idx >= len(dayCalEventList):
-                    end_idx = len(dayCalEventList) - 1
-                for i in range(idx, end_idx + 1):
-                    dayCalEventList[i].append(event)
-            elif idx >= 0:
-                dayCalEventList[idx].append(event)
-
-        return dayCalEventList
+    def get_http(self):
+        # The HTTP connection of the current thread, kept open for the next requests it makes
+        http = getattr(self.threadLocal, 'http', None)
+        if http is None:
+            http = httplib2.Http()
+            if self.credentials is not None:
+                http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=http)
+            self.threadLocal.http = http
+        return http
+
+    def iter_pages(self, **kwargs):
+        # Yields each page of an events().list request as it comes in, following the page tokens to the last page
+        request = self.service.events().list(fields=EVENT_FIELDS, maxResults=EVENTS_PER_PAGE, **kwargs)
+        while request is not None:
+            result = request.execute(http=self.get_http())
+            yield result
+            request = self.service.events().list_next(request, result)
+
+    def iter_events(self, **kwargs):
+        # Yields the events of every page of an events().list request, without waiting for the pages after
+        for page in self.iter_pages(**kwargs):
+            yield from page.get('items', [])
+
+    def list_events(self, **kwargs):
+        # Goes through every page of an events().list request, returning the events and the sync token of the last page
+        items = []
+        syncToken = None
+        for page in self.iter_pages(**kwargs):
+            items += page.get('items', [])
+            syncToken = page.get('nextSyncToken')
+        return items, syncToken
+
+    def sync_events(self, calendar, startDatetime, endDatetime):
+        """
+        Brings the stored copy of the calendar up to date and returns its events between the start and end datetimes.
+        Only the events changed since the last sync are downloaded, unless the calendar was never synced, its sync
+        token has expired or the window is not covered by the last full sync, in which case it is synced in full.
+        """
+        state = self.store.get_sync_state(calendar)
+        if state is not None:
+            syncToken, windowStart, windowEnd = state
+            if windowStart <= startDatetime and endDatetime <= windowEnd:
+                try:
+                    changes, syncToken = self.list_events(calendarId=calendar, singleEvents=True, syncToken=syncToken)
+                    self.store.apply_changes(calendar, changes, syncToken)
+                    self.logger.info('{}: {} events changed since the last sync.'.format(calendar, len(changes)))
+                    return self.store.get_events(calendar, startDatetime, endDatetime)
+                except HttpError as e:
+                    # 410 Gone, the sync token has expired and the calendar has to be synced again in full
+                    if e.resp.status != 410:
+                        raise
+                    self.logger.info('{}: sync token expired, syncing again in full.'.format(calendar))
+                    self.store.clear(calendar)
+
+        windowEnd = endDatetime + SYNC_WINDOW_PADDING
+        events, syncToken = self.list_events(calendarId=calendar, singleEvents=True, timeMin=startDatetime.isoformat(),
+                                             timeMax=windowEnd.isoformat())
+        self.store.replace_events(calendar, events, syncToken, startDatetime, windowEnd)
+        self.logger.info('{}: {} events synced in full.'.format(calendar, len(events)))
+        return self.store.get_events(calendar, startDatetime, endDatetime)
+
+    def retrieve_calendar(self, calendar, startDatetime, endDatetime, localTZ, thresholdHours):
+        # Returns the events of a single calendar between the start and end datetimes, converted as they come in
+        start = time.perf_counter()
+        eventList = []
+        if self.store is not None:
+            for event in self.sync_events(calendar, startDatetime, endDatetime):
+                new_event = self.to_event(event, localTZ, thresholdHours)
+                # the store also has the events just outside the window, leave them out as the API would have
+                if new_event['endDatetime'] > startDatetime and new_event['startDatetime'] < endDatetime:
+                    eventList.append(new_event)
+        else:
+            for event in self.iter_events(calendarId=calendar, timeMin=startDatetime.isoformat(),
+                                          timeMax=endDatetime.isoformat(), singleEvents=True, orderBy='startTime'):
+                eventList.append(self.to_event(event, localTZ, thresholdHours))
+        self.logger.info('{}: {} events retrieved in {:.2f} s.'.format(calendar, len(eventList),
+                                                                      time.perf_counter() - start))
+        return eventList
+
+    def to_event(self, event, localTZ, thresholdHours):
+        # extracting and converting the data of an event as the Calendar API returns it
+        new_event = {}
+
+        if event['start'].get('dateTime') is None:
+            new_event['allday'] = True
+            new_event['startDatetime'] = self.to_datetime(event['start'].get('date'), localTZ)
+        else:
+            new_event['allday'] = False
+            new_event['startDatetime'] = self.to_datetime(event['start'].get('dateTime'), localTZ)
+
+        if event['end'].get('dateTime') is None:
+            new_event['endDatetime'] = self.adjust_end_time(self.to_datetime(event['end'].get('date'), localTZ),
+                                                            localTZ)
+        else:
+            new_event['endDatetime'] = self.adjust_end_time(self.to_datetime(event['end'].get('dateTime'), localTZ),
+                                                            localTZ)
+
+        new_event['summary'] = event.get('summary', '(No Title)')
+        new_event['updatedDatetime'] = self.to_datetime(event['updated'], localTZ)
+        new_event['isUpdated'] = self.is_recent_updated(new_event['updatedDatetime'], thresholdHours)
+        new_event['isMultiday'] = self.is_multiday(new_event['startDatetime'], new_event['endDatetime'])
+
+        # Location override for Google Meet
+        new_event['location'] = event.get('location', '')
+        if new_event['location'].startswith('https://meet.google.com'):
+            new_event['location'] = 'Google Meet Conference'
+
+        # Default 'None' if description is empty
+        new_event['description'] = event.get('description', '')
+        if new_event['description'] == '':
+            new_event['description'] = 'None'
+
+        return new_event
 
     def retrieve_events(self, calendars, startDatetime, endDatetime, localTZ, thresholdHours):
         # Call the Google Calendar API and return a list of events that fall within the specified dates
@@ -133,57 +263,25 @@ class GcalHelper:
             return eventList
 
         self.logger.info('Retrieving events between ' + minTimeStr + ' and ' + maxTimeStr + '...')
-        events_result = []
-        for cal in calendars:
-            events_result.append(
-                self.service.events().list(calendarId=cal, timeMin=minTimeStr,
-                                           timeMax=maxTimeStr, singleEvents=True,
-                                           orderBy='startTime').execute()
-            )
-
-        events = []
-        for eve in events_result:
-            events += eve.get('items', [])
-            # events = events_result.get('items', [])
-
-        if not events:
-            self.logger.info('No upcoming events found.')
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, min(self.maxWorkers, len(calendars))),
+                                thread_name_prefix='gcal') as executor:
+            futures = [executor.submit(self.retrieve_calendar, cal, startDatetime, endDatetime, localTZ, thresholdHours)
+                       for cal in calendars]
+            for cal, future in zip(calendars, futures):
+                try:
+                    eventList += future.result()
+                except Exception as e:
+                    # show the other calendars rather than nothing at all
+                    self.logger.error('{}: could not be retrieved: {}'.format(cal, e))
+                    errors.append(e)
+        if calendars and len(errors) == len(calendars):
+            raise errors[0]
 
-        for event in events:
-            # extracting and converting events data into a new list
-            new_event = {}
-
-            if event['start'].get('dateTime') is None:
-                new_event['allday'] = True
-                new_event['startDatetime'] = self.to_datetime(event['start'].get('date'), localTZ)
-            else:
-                new_event['allday'] = False
-                new_event['startDatetime'] = self.to_datetime(event['start'].get('dateTime'), localTZ)
-
-            if event['end'].get('dateTime') is None:
-                new_event['endDatetime'] = self.adjust_end_time(self.to_datetime(event['end'].get('date'), localTZ), localTZ)
-            else:
-                new_event['endDatetime'] = self.adjust_end_time(self.to_datetime(event['end'].get('dateTime'), localTZ), localTZ)
-
-            new_event['summary'] = event.get('summary', '(No Title)')
-            new_event['updatedDatetime'] = self.to_datetime(event['updated'], localTZ)
-            new_event['isUpdated'] = self.is_recent_updated(new_event['updatedDatetime'], thresholdHours)
-            new_event['isMultiday'] = self.is_multiday(new_event['startDatetime'], new_event['endDatetime'])
-
-            # Location override for Google Meet
-            new_event['location'] = event.get('location', '')
-            if new_event['location'].startswith('https://meet.google.com'):
-                new_event['location'] = 'Google Meet Conference'
-
-            # Default 'None' if description is empty
-            new_event['description'] = event.get('description', '')
-            if new_event['description'] == '':
-                new_event['description'] = 'None'
-
-            eventList.append(new_event)
+        if not eventList:
+            self.logger.info('No upcoming events found.')
 
         # We need to sort eventList because the event will be sorted in "calendar order" instead of hours order
-        # TODO: improve because of double cycle for now is not much cost
         eventList = sorted(eventList, key=lambda k: k['startDatetime'])
 
         return eventList
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This part of the code keeps a local copy of the events of each calendar in a SQLite database, along with the sync token
+the Calendar API handed out with them. On the next boot only the events that changed since then are downloaded and
+applied to the copy, instead of the whole 5 week window of every calendar, and the month and day views are read from
+the copy. See GcalHelper.sync_events.
+"""
+
+import datetime as dt
+import json
+import pathlib
+import sqlite3
+import threading
+
+# Events starting or ending this close to a window are read from the store and left to the caller to filter exactly,
+# as all-day events only have a date and their time depends on the timezone they are shown in
+WINDOW_MARGIN = dt.timedelta(days=2)
+
+
+def get_timestamp(when):
+    # Seconds since the epoch of the start or end of an event, all-day events taken at midnight UTC
+    if 'dateTime' in when:
+        return dt.datetime.fromisoformat(when['dateTime'].replace('Z', '+00:00')).timestamp()
+    return dt.datetime.fromisoformat(when['date']).replace(tzinfo=dt.timezone.utc).timestamp()
+
+
+class EventStore:
+
+    def __init__(self, path=None):
+        self.currPath = str(pathlib.Path(__file__).parent.absolute())
+        self.path = path or self.currPath + '/events.sqlite'
+        self.lock = threading.Lock()  # the connection is shared by the threads fetching the calendars
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS calendars (calendar_id TEXT PRIMARY KEY, sync_token TEXT, '
+                            'window_start TEXT, window_end TEXT, synced TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS events (calendar_id TEXT, event_id TEXT, start REAL, end REAL, '
+                            'data TEXT, PRIMARY KEY (calendar_id, event_id))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS events_start ON events (calendar_id, start)')
+
+    def get_sync_state(self, calendar_id):
+        """
+        Returns the sync token of the calendar and the window of its last full sync, as (token, start, end), or
+        None if the calendar has not been synced yet.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT sync_token, window_start, window_end FROM calendars WHERE calendar_id = ?',
+                                  (calendar_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return row[0], dt.datetime.fromisoformat(row[1]), dt.datetime.fromisoformat(row[2])
+
+    def replace_events(self, calendar_id, events, sync_token, window_start, window_end):
+        # Stores the result of a full sync of the calendar, in place of anything stored for it before
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM events WHERE calendar_id = ?', (calendar_id,))
+            self.db.executemany('INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?)',
+                                [self.get_row(calendar_id, event) for event in events
+                                 if event.get('status') != 'cancelled'])
+            self.db.execute('INSERT OR REPLACE INTO calendars VALUES (?, ?, ?, ?, ?)',
+                            (calendar_id, sync_token, window_start.isoformat(), window_end.isoformat(),
+                             dt.datetime.now(dt.timezone.utc).isoformat()))
+
+    def apply_changes(self, calendar_id, events, sync_token):
+        # Applies the events changed since the last sync, those that were cancelled or deleted are removed
+        with self.lock, self.db:
+            self.db.executemany('DELETE FROM events WHERE calendar_id = ? AND event_id = ?',
+                                [(calendar_id, event['id']) for event in events if event.get('status') == 'cancelled'])
+            self.db.executemany('INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?)',
+                                [self.get_row(calendar_id, event) for event in events
+                                 if event.get('status') != 'cancelled'])
+            self.db.execute('UPDATE calendars SET sync_token = ?, synced = ? WHERE calendar_id = ?',
+                            (sync_token, dt.datetime.now(dt.timezone.utc).isoformat(), calendar_id))
+
+    def clear(self, calendar_id):
+        # Forgets the calendar, e.g. when its sync token has expired
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM events WHERE calendar_id = ?', (calendar_id,))
+            self.db.execute('DELETE FROM calendars WHERE calendar_id = ?', (calendar_id,))
+
+    def get_row(self, calendar_id, event):
+        return (calendar_id, event['id'], get_timestamp(event['start']), get_timestamp(event['end']),
+                json.dumps(event))
+
+    def get_events(self, calendar_id, start, end):
+        """
+        Returns the stored events of the calendar that may overlap the window between the start and end datetimes,
+        in the form the Calendar API returned them. Events near the edges of the window may fall just outside it.
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT data FROM events WHERE calendar_id = ? AND start <= ? AND end >= ? '
+                                   'ORDER BY start', (calendar_id, (end + WINDOW_MARGIN).timestamp(),
+                                                      (start - WINDOW_MARGIN).timestamp())).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -17,13 +17,7 @@ import datetime
 from datetime import datetime as dt
 import json
 import logging
-from time import sleep
 
-from pytz import timezone
-from gcal.gcal import GcalHelper
-# from gcal.gcal import GcalModule
-from owm.owm import OWMModule
-from render.render import RenderHelper
 from power.power import PowerHelper
 
 def main():
@@ -49,25 +43,145 @@ def main():
         return
 
     # Basic configuration settings (user replaceable)
-    config_file = open('config.json')
-    config = json.load(config_file)
+    config = load_config()
 
-    display_tz = timezone(config['displayTZ']) # list of timezones - print(pytz.all_timezones)
     day_view_display_time_in_sec = config['dayViewDisplayTimeInSec']  # list of timezones - print(pytz.all_timezones)
-    threshold_hours = config['thresholdHours']  # considers events updated within last 12 hours as recently updated
-    max_events_per_day = config['maxEventsForMonthView']  # limits number of events to display (remainder displayed as '+X more')
     is_display_to_screen = config['isDisplayToScreen']  # set to true when debugging rendering without displaying to screen
+    min_display_change = config['minDisplayChange']  # fraction of pixels that must change before the screen is refreshed
+    is_keep_last_frame = config['isKeepLastFrame']  # set to true to keep the last frame on the SD card, needed for a minDisplayChange above 0
+    dither_mode = config['ditherMode']  # none / ordered / diffusion, how colors outside the panel palette are approximated
+    panel_palette = config['panelPalette']  # RGB values measured off the panel, e.g. {"red": [160, 40, 30]}
+    display_busy_timeout = config['displayBusyTimeoutInSec']  # give up if the display stays busy for longer than this
+    display_backend = config['displayBackend']  # hardware / emulator, the emulator saves the image to display/emulator.png
+    calibration_refreshes_per_cycle = config['calibrationRefreshesPerCycle']  # refreshes that call for one calibration cycle
+    max_calibration_cycles = config['maxCalibrationCycles']  # upper limit of calibration cycles to run at once
     is_shutdown_on_complete = config['isShutdownOnComplete']  # set to true to conserve power, false if in debugging mode
     auto_shutdown_delay_time_in_sec = config['autoShutdownDelayTimeInSec']
+    screen_width = config['screenWidth']  # Width of E-Ink display. Default is landscape. Need to rotate image to fit.
+    screen_height = config['screenHeight']  # Height of E-Ink display. Default is landscape. Need to rotate image to fit.
+    render_server_url = config['renderServerUrl']  # e.g. http://192.168.1.10:8080 to download the views from remote/server.py, empty to render them here
+    render_server_timeout = config['renderServerTimeoutInSec']  # give up on the render server if it does not answer within this
+
+    # Retrieve Battery Data
+    power_service = PowerHelper()
+    power_service.sync_time()
+    curr_battery_level = power_service.get_battery()
+    logger.info('Battery level at start: {:.3f}'.format(curr_battery_level))
+
+    if render_server_url:
+        # The render server fetches the events and weather, renders the views and packs them into frames for the
+        # display, so none of that, nor Chrome or the Google client libraries, is needed on this device
+        from remote.client import FrameClient
+        render_service = None
+        frame_client = FrameClient(render_server_url, render_server_timeout)
+        rendered_views = frame_client.get_frames(['day', 'month'], curr_battery_level)
+    else:
+        views = get_calendar_views(config, logger, curr_battery_level)
+        if views is None:
+            return
+
+        # Generate Day View and Month View at the same time. Each view is handed over as soon as it is done, so the
+        # display can start refreshing with the Day View while the Month View is still being rendered.
+        render_service = create_render_service(config)
+        rendered_views = render_service.render_views(views)
+    start = dt.now()
+
+    try:
+        if not is_display_to_screen:
+            for name, image in rendered_views:
+                logger.info("{} view generated in {}".format(name.capitalize(), dt.now() - start))
+            if render_service is not None:
+                render_service.close()
+
+        else:
+            # Display Day View, then Month View. The display is initialised once for both and put to sleep once at the end.
+            from display.display import DisplayHelper
+            with DisplayHelper(screen_width, screen_height, keep_frame=is_keep_last_frame, dither=dither_mode, palette=panel_palette,
+                               busy_timeout=display_busy_timeout, backend=display_backend) as display_service:
+                calendar_images = {}
+                day_view_update = None
+                for name, image in rendered_views:
+                    logger.info("{} view generated in {}".format(name.capitalize(), dt.now() - start))
+                    calendar_images[name] = image
+                    if name == 'day':
+                        day_view_buf = display_service.prepare(image)
+                        if not display_service.is_shown(day_view_buf, 'day'):
+                            # the Day View has changed, so it is shown whatever the Month View, start right away
+                            day_view_update = display_service.update_async(day_view_buf, min_display_change, 'day')
+                if render_service is not None:
+                    # both views are rendered, quit Chrome now rather than keep it in memory through the refreshes
+                    render_service.close()
+
+                # Quantize the month view while the display is busy refreshing the day view
+                month_calendar_buf = display_service.prepare(calendar_images['month'])
+                if (day_view_update is None and display_service.is_shown(month_calendar_buf, 'month') and
+                        display_service.is_on_display(month_calendar_buf)):
+                    # Neither view changed since the last run and the display still holds the Month View, so the whole
+                    # Day View and Month View cycle is skipped
+                    logger.info("Day View and Month View unchanged, display left as it is.")
+                else:
+                    if day_view_update is None:
+                        day_view_update = display_service.update_async(day_view_buf, min_display_change, 'day')
+                    day_view_update.result()
+
+                    display_time_in_min = day_view_display_time_in_sec / 60
+                    logger.info("Day View displayed, waiting {} min to redisplay Month View... ".format(display_time_in_min))
+                    time.sleep(day_view_display_time_in_sec) # Wait 5min before displaying Month view again
+
+                    calibration_cycles = display_service.get_calibration_cycles(calibration_refreshes_per_cycle, max_calibration_cycles)
+                    if calibration_cycles > 0:
+                        # calibrate display to prevent ghosting, depending on how often it was refreshed since the last calibration
+                        display_service.calibrate(cycles=calibration_cycles)  # to calibrate in production
+
+                    display_service.show(month_calendar_buf, min_display_change, 'month')
+
+    except Exception as e:
+        logger.info("Error while generating or displaying the calendar views")
+        logger.error(e)
+        return
+    finally:
+        # in case rendering or displaying failed before the render service was closed
+        rendered_views.close()
+        if render_service is not None:
+            render_service.close()
+
+    curr_battery_level = power_service.get_battery()
+    logger.info('Battery level at end: {:.3f}'.format(curr_battery_level))
+
+    logger.info("Completed calendar update")
+
+    if is_shutdown_on_complete:
+        # Perform Smart Shutdown:
+        # - Wait some min (defined in config) before initiating shutdown
+        # - After some min (defined in config) check if any user is logged in, if so then delay shutdown
+        # - Recheck and delay shutdown until user is no longer logged in.
+
+        perform_smart_shutdown(logger, auto_shutdown_delay_time_in_sec)
+
+def load_config():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')) as config_file:
+        return json.load(config_file)
+
+def get_calendar_views(config, logger, curr_battery_level):
+    """
+    Fetches the events and the weather and returns the Day View and Month View to generate, as the list of
+    (name, method, args) taken by RenderHelper.render_views, or None if they could not be fetched.
+    """
+    from pytz import timezone
+    from gcal.gcal import GcalHelper
+    from gcal.eventindex import EventIndex
+    # from gcal.gcal import GcalModule
+    from owm.owm import OWMModule
+
+    display_tz = timezone(config['displayTZ']) # list of timezones - print(pytz.all_timezones)
+    threshold_hours = config['thresholdHours']  # considers events updated within last 12 hours as recently updated
+    max_events_per_day = config['maxEventsForMonthView']  # limits number of events to display (remainder displayed as '+X more')
     battery_display_mode = config['batteryDisplayMode']  # 0: do not show / 1: always show / 2: show when battery is low
     week_start_day = config['weekStartDay']  # Monday = 0, Sunday = 6
     day_of_week_text = config['dayOfWeekText'] # Monday as first item in list
-    screen_width = config['screenWidth']  # Width of E-Ink display. Default is landscape. Need to rotate image to fit.
-    screen_height = config['screenHeight']  # Height of E-Ink display. Default is landscape. Need to rotate image to fit.
-    image_width = config['imageWidth']  # Width of image to be generated for display.
-    image_height = config['imageHeight'] # Height of image to be generated for display.
-    rotate_angle = config['rotateAngle']  # If image is rendered in portrait orientation, angle to rotate to fit screen
     calendars = config['calendars']  # Google calendar ids
+    is_incremental_sync = config['isIncrementalSync']  # set to true to keep the events on disk and only download the changes
+    max_calendar_fetch_workers = config['maxCalendarFetchWorkers']  # calendars retrieved at the same time
     is24hour = config['is24h']  # set 24 hour time
     day_view_day_to_fetch = config['maxDayFetchForDayView'] # Number of days to retrieve from gcal, keep to 3 unless other parts of the code are changed too
     day_view_cal_days_to_show = config['maxEventsForDayView']
@@ -81,12 +195,6 @@ def main():
     curr_date = curr_datetime.date()
     logger.info("Calender time synchronised to {}".format(curr_datetime))
 
-    # Retrieve Battery Data
-    power_service = PowerHelper()
-    power_service.sync_time()
-    curr_battery_level = power_service.get_battery()
-    logger.info('Battery level at start: {:.3f}'.format(curr_battery_level))
-
     # For this implementation, each week starts on a Sunday and the calendar begins on the nearest elapsed Sunday
     # The calendar will also display 5 weeks of events to cover the upcoming month, ending on a Saturday
     cal_view_start_date = curr_date - datetime.timedelta(days=((curr_date.weekday() + (7 - week_start_day)) % 7))
@@ -97,13 +205,19 @@ def main():
     # Using Google Calendar to retrieve all events within start and end date (inclusive)
     try:
         start = dt.now()
-        gcal_service = GcalHelper()
+        event_store = None
+        if is_incremental_sync:
+            from gcal.store import EventStore
+            event_store = EventStore()
+        gcal_service = GcalHelper(store=event_store, max_workers=max_calendar_fetch_workers)
         month_cal_event_list = gcal_service.retrieve_events(calendars, cal_view_start_datetime, cal_view_end_datetime, display_tz, threshold_hours)
-        logger.info("Month View Calendar events retrieved in " + str(dt.now() - start))
+        # the days of the Day View are within the Month View, so both are made from this one fetch
+        event_index = EventIndex(month_cal_event_list)
+        logger.info("Calendar events retrieved in " + str(dt.now() - start))
 
         # Populate dictionary with information to be rendered on e-ink display
         cal_month_view_dict = {
-            'eventsMonthCal': month_cal_event_list,
+            'eventIndex': event_index,
             'calStartDate': cal_view_start_date,
             'today': curr_date,
             'lastRefresh': curr_datetime,
@@ -117,16 +231,7 @@ def main():
     except Exception as e:
         logger.info("Error while fetching events from GCal")
         logger.error(e)
-        return
-
-    # Generate Month View
-    try:
-        render_service = RenderHelper(image_width, image_height, rotate_angle)
-        month_calendar_image = render_service.generateMonthCal(cal_month_view_dict)
-    except Exception as e:
-        logger.info("Error while generating Month View")
-        logger.error(e)
-        return
+        return None
 
     try:
         # Retrieve Weather Data
@@ -143,11 +248,8 @@ def main():
         logger.info('Retrieved Weather Data')
 
 
-        # Retrieve Events for Day View
-        day_view_start_datetime = display_tz.localize(dt.combine(curr_date, dt.min.time()))
-        day_view_end_datetime = display_tz.localize(dt.combine(curr_date + datetime.timedelta(days=day_view_day_to_fetch - 1), dt.max.time()))
-        day_cal_event_list = gcal_service.get_events(curr_date, calendars, day_view_start_datetime, day_view_end_datetime, display_tz, day_view_day_to_fetch, threshold_hours)
-        logger.info("Day View Calendar events retrieved in " + str(dt.now() - start))
+        # Events for Day View, from those retrieved for the Month View
+        day_cal_event_list = event_index.get_days(curr_date, day_view_day_to_fetch)
 
         # bundle battery data
         battery_status = {
@@ -155,48 +257,31 @@ def main():
             'batteryDisplayMode': battery_display_mode,
         }
 
-        # Generate Day View
-        daily_calendar_image = render_service.generateDailyCal(curr_date, current_weather, hourly_forecast, daily_forecast, weather_forecast_times, day_cal_event_list, day_view_day_to_fetch, day_view_cal_days_to_show,battery_status)
-
-        # Display Day View
-        if is_display_to_screen:
-            from display.display import DisplayHelper
-            display_service = DisplayHelper(screen_width, screen_height)
-            display_service.update(daily_calendar_image)
-            display_service.sleep()
-
-            display_time_in_min = day_view_display_time_in_sec / 60
-            logger.info("Day View displayed, waiting {} min to redisplay Month View... ".format(display_time_in_min))
-            time.sleep(day_view_display_time_in_sec) # Wait 5min before displaying Month view again
-
     except Exception as e:
         logger.error(e)
-        return
-
-    # Display Month View
-    if is_display_to_screen:
-        from display.display import DisplayHelper
-        display_service = DisplayHelper(screen_width, screen_height)
-
-        if curr_date.weekday() == week_start_day:
-            # calibrate display once a week to prevent ghosting
-            display_service.calibrate(cycles=1)  # to calibrate in production
+        return None
 
-        display_service.update(month_calendar_image)
-        display_service.sleep()
+    return [
+        ('day', 'generateDailyCal', (curr_date, current_weather, hourly_forecast, daily_forecast, weather_forecast_times, day_cal_event_list, day_view_day_to_fetch, day_view_cal_days_to_show, battery_status)),
+        ('month', 'generateMonthCal', (cal_month_view_dict,)),
+    ]
 
-    curr_battery_level = power_service.get_battery()
-    logger.info('Battery level at end: {:.3f}'.format(curr_battery_level))
+def create_render_service(config):
+    from render.render import RenderHelper
 
-    logger.info("Completed calendar update")
-
-    if is_shutdown_on_complete:
-        # Perform Smart Shutdown:
-        # - Wait some min (defined in config) before initiating shutdown
-        # - After some min (defined in config) check if any user is logged in, if so then delay shutdown
-        # - Recheck and delay shutdown until user is no longer logged in.
-
-        perform_smart_shutdown(logger, auto_shutdown_delay_time_in_sec)
+    image_width = config['imageWidth']  # Width of image to be generated for display.
+    image_height = config['imageHeight'] # Height of image to be generated for display.
+    rotate_angle = config['rotateAngle']  # If image is rendered in portrait orientation, angle to rotate to fit screen
+    render_backend = config['renderBackend']  # chrome: screenshot the HTML templates / native: draw the views with Pillow
+    render_ready_timeout = config['renderReadyTimeoutInSec']  # longest wait for fonts and images to load before a screenshot
+    is_keep_render_artifacts = config['isKeepRenderArtifacts']  # set to true to also write the HTML and screenshots to the render folder
+    is_palette_native = config['isPaletteNative']  # set to true to render only in the panel's colors, skipping the dithering
+    render_cache_size = config['renderCacheSizeInMB']  # disk space for screenshots of unchanged pages, 0 to disable the cache
+    is_optimize_templates = config['isOptimizeTemplates']  # set to true to inline only the CSS and font glyphs the pages use
+
+    return RenderHelper(image_width, image_height, rotate_angle, render_backend, render_ready_timeout,
+                        is_keep_render_artifacts, render_cache_size * 1024 * 1024, is_palette_native,
+                        is_optimize_templates)
 
 def is_user_logged_in(logger):
     try:
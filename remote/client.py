@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This part of the code runs on the Pi when the views are rendered by remote/server.py on another machine. It downloads
+the day and month views as frames that are already quantized and packed for the panel, so they can go straight to the
+display. The last frame of each view is kept on the SD card along with its ETag, so a view that has not changed since
+the last boot is not downloaded again over the Wi-Fi.
+"""
+
+import gzip
+import logging
+import os
+import pathlib
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+class FrameClient:
+
+    def __init__(self, server_url, timeout=60, cache_dir=None):
+        self.logger = logging.getLogger('maginkcal')
+        self.currPath = str(pathlib.Path(__file__).parent.absolute())
+        self.serverUrl = server_url.rstrip('/')
+        self.timeout = timeout  # seconds to wait for the server, which may have to render the views first
+        self.cacheDir = cache_dir or self.currPath + '/frames'
+
+    def get_cached(self, view):
+        # The last frame downloaded for view and its ETag, or (None, None)
+        try:
+            with open(os.path.join(self.cacheDir, view + '.etag'), 'r') as file:
+                etag = file.read().strip()
+            with open(os.path.join(self.cacheDir, view + '.bin'), 'rb') as file:
+                return etag, file.read()
+        except OSError:
+            return None, None
+
+    def put_cached(self, view, etag, frame):
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            for ext, data, mode in (('.bin', frame, 'wb'), ('.etag', etag, 'w')):
+                path = os.path.join(self.cacheDir, view + ext)
+                with open(path + '.tmp', mode) as file:
+                    file.write(data)
+                os.replace(path + '.tmp', path)
+        except OSError as e:
+            self.logger.info('Unable to keep the {} frame: {}'.format(view, e))
+
+    def get_frame(self, view, battery_level):
+        """
+        Returns the packed frame of view from the render server, or the one downloaded last time if the server says
+        it has not changed. battery_level is passed on, since the views show the battery of this device.
+        """
+        start = time.perf_counter()
+        etag, cached = self.get_cached(view)
+        url = '{}/frame/{}?{}'.format(self.serverUrl, view, urllib.parse.urlencode({'battery': battery_level}))
+        request = urllib.request.Request(url, headers={'Accept-Encoding': 'gzip'})
+        if etag:
+            request.add_header('If-None-Match', etag)
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                frame = response.read()
+                size = len(frame)
+                if response.headers.get('Content-Encoding') == 'gzip':
+                    frame = gzip.decompress(frame)
+                etag = response.headers.get('ETag')
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                raise
+            self.logger.info('{} frame unchanged on the render server, checked in {:.2f} s.'.format(
+                view.capitalize(), time.perf_counter() - start))
+            return cached
+
+        if etag:
+            self.put_cached(view, etag, frame)
+        self.logger.info('{} frame downloaded in {:.2f} s ({:.0f} kB).'.format(
+            view.capitalize(), time.perf_counter() - start, size / 1024))
+        return frame
+
+    def get_frames(self, views, battery_level):
+        """
+        Returns an iterator of (name, packed frame) for each of the views, downloading each one as it is asked for, so
+        the display can start refreshing with the first view while the next one is still on its way.
+        """
+        for view in views:
+            yield view, self.get_frame(view, battery_level)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This is the render server, for running the heavy part of the calendar on a machine other than the Pi: fetching the
+events and weather, rendering the views and quantizing them to the panel's colors. It serves each view as a frame
+packed the way the panel takes it, so the Pi only has to download it and send it to the display, see
+remote/client.py and renderServerUrl in config.json.
+
+    python3 -m remote.server
+
+GET /frame/day and /frame/month return the packed frames, 1200 x 1600 pixels at 4 bits each. The device passes its
+battery level as ?battery=, for the battery icon. Frames are rendered again once they are older than
+renderServerMaxAgeInSec or the battery icon changes, and each response carries an ETag, so a device that already has
+the frame gets a 304 Not Modified instead of downloading it again.
+
+There is no authentication, anyone who can reach the server can make it fetch the calendar and read the frames, so it
+listens on 127.0.0.1 unless renderServerBindAddress says otherwise and is only meant for a trusted LAN.
+"""
+
+import gzip
+import hashlib
+import http.server
+import logging
+import sys
+import threading
+import time
+import urllib.parse
+
+import maginkcal
+
+VIEWS = ('day', 'month')
+
+
+class FrameStore:
+
+    def __init__(self, config, max_age):
+        self.logger = logging.getLogger('maginkcal')
+        self.config = config
+        self.maxAge = max_age  # seconds before the frames are rendered again with fresh events and weather
+        self.lock = threading.Lock()  # devices asking at the same time wait for one rendering of the views
+        self.frames = {}  # (ETag, packed frame, gzipped frame) of each view
+        self.battText = None
+        self.renderedAt = None
+        self.renderService = None
+        self.epd = None
+
+    def is_stale(self, batt_text):
+        return (self.renderedAt is None or batt_text != self.battText or
+                time.monotonic() - self.renderedAt >= self.maxAge)
+
+    def get_frame(self, view, battery_level):
+        """
+        Returns the (ETag, packed frame, gzipped frame) of view, rendering the views first if needed, or None if the
+        events or the weather could not be fetched and no earlier frame is available.
+        """
+        with self.lock:
+            if self.renderService is None:
+                # kept for the life of the server, so the browser is only started once
+                self.renderService = maginkcal.create_render_service(self.config)
+            batt_text = self.renderService.get_battery_text(battery_level, self.config['batteryDisplayMode'])
+            if self.is_stale(batt_text):
+                self.render(battery_level, batt_text)
+            return self.frames.get(view)
+
+    def render(self, battery_level, batt_text):
+        from display.epd13in3E import EPD
+        from display.quantizer import Quantizer
+
+        start = time.perf_counter()
+        views = maginkcal.get_calendar_views(self.config, self.logger, battery_level)
+        if views is None:
+            return
+        if self.epd is None:
+            # only used to quantize and pack the frames, the panel itself is on the device
+            self.epd = EPD(Quantizer(self.config['panelPalette'], self.config['ditherMode']))
+
+        frames = {}
+        rendered_views = self.renderService.render_views(views)
+        try:
+            for name, image in rendered_views:
+                frame = bytes(self.epd.getbuffer(image))
+                # frames are mostly flat colors and shrink a lot, which matters over the Wi-Fi of a Pi Zero
+                frames[name] = ('"{}"'.format(hashlib.sha256(frame).hexdigest()), frame, gzip.compress(frame, 6))
+        finally:
+            rendered_views.close()
+
+        self.frames = frames
+        self.battText = batt_text
+        self.renderedAt = time.monotonic()
+        self.logger.info('Views rendered and packed in {:.2f} s.'.format(time.perf_counter() - start))
+
+    def close(self):
+        if self.renderService is not None:
+            self.renderService.close()
+
+
+class FrameHandler(http.server.BaseHTTPRequestHandler):
+
+    store = None  # FrameStore shared by all requests
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'frame' or parts[1] not in VIEWS:
+            self.send_error(404)
+            return
+        try:
+            battery_level = float(urllib.parse.parse_qs(url.query).get('battery', ['-1'])[0])
+        except ValueError:
+            self.send_error(400, 'Invalid battery level')
+            return
+
+        try:
+            frame = self.store.get_frame(parts[1], battery_level)
+        except Exception as e:
+            self.store.logger.error(e)
+            frame = None
+        if frame is None:
+            self.send_error(503, 'Unable to render the calendar')
+            return
+
+        etag, data, gzipped = frame
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzipped
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        self.store.logger.info('{} - {}'.format(self.address_string(), format % args))
+
+
+def main():
+    logger = logging.getLogger('maginkcal')
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    logger.setLevel(logging.INFO)
+
+    config = maginkcal.load_config()
+    bind_address = config['renderServerBindAddress']  # address the render server listens on, e.g. 0.0.0.0 for every interface
+    port = config['renderServerPort']  # port the render server listens on
+    max_age = config['renderServerMaxAgeInSec']  # how long rendered frames are served before fetching the calendar again
+
+    FrameHandler.store = FrameStore(config, max_age)
+    server = http.server.ThreadingHTTPServer((bind_address, port), FrameHandler)
+    logger.info('Render server listening on {}:{}'.format(bind_address, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        FrameHandler.store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This part of the code keeps a single headless Chrome instance around for all the pages rendered in a run. Starting
+Chrome is by far the slowest part of taking a screenshot on a Pi Zero, so the browser is started and sized to the
+resolution of the eInk display once, on the first page, and only quit when the session is closed. Pages are handed to
+the browser as markup and their screenshots come back as bytes, so nothing is written to the SD card along the way.
+
+The session can be shared by several threads. Each page gets a tab of its own, kept for the next time the page is
+rendered, so while one page is being captured the browser can already be laying out and loading the fonts of the
+others, and a session that lives on, as in the render server, never has more tabs open than there are pages.
+"""
+
+import io
+import time
+import logging
+import threading
+from PIL import Image
+
+# Replaces the current document with the markup passed in, the same as if it had been loaded from a file
+WRITE_SCRIPT = """
+document.open();
+document.write(arguments[0]);
+document.close();
+"""
+
+# Sets window.pageReady once the page has loaded, its web fonts are in and every image is decoded. Images that fail to
+# load do not hold up the capture, they would not show up any later.
+READY_SCRIPT = """
+window.pageReady = false;
+function whenLoaded() {
+    var images = Array.prototype.map.call(document.images, function (img) {
+        return img.decode().catch(function () {});
+    });
+    Promise.all([document.fonts.ready].concat(images)).then(function () { window.pageReady = true; });
+}
+if (document.readyState === 'complete') {
+    whenLoaded();
+} else {
+    window.addEventListener('load', whenLoaded);
+}
+"""
+
+READY_POLL_INTERVAL = 0.05  # seconds between checks of window.pageReady
+
+
+class BrowserSession:
+
+    def __init__(self, width, height, ready_timeout=10, chrome_args=()):
+        self.logger = logging.getLogger('maginkcal')
+        self.imageWidth = width
+        self.imageHeight = height
+        self.readyTimeout = ready_timeout  # longest wait for a page to be ready, in seconds, before capturing anyway
+        self.chromeArgs = list(chrome_args)  # extra command line switches for Chrome
+        self.driver = None
+        self.lock = threading.RLock()  # WebDriver commands go to one tab at a time, even with several threads
+        self.tabs = {}  # window handle of the tab used by each page
+        self.startupTime = None
+        self.timings = []  # (page, seconds) for each page captured in this session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def set_viewport_size(self, driver):
+        from selenium.webdriver.common.by import By
+
+        # Extract the current window size from the driver
+        current_window_size = driver.get_window_size()
+
+        # Extract the client window size from the html tag
+        html = driver.find_element(By.TAG_NAME,'html')
+        inner_width = int(html.get_attribute("clientWidth"))
+        inner_height = int(html.get_attribute("clientHeight"))
+
+        # "Internal width you want to set+Set "outer frame width" to window size
+        target_width = self.imageWidth + (current_window_size["width"] - inner_width)
+        target_height = self.imageHeight + (current_window_size["height"] - inner_height)
+
+        driver.set_window_rect(
+            width=target_width,
+            height=target_height)
+
+    def start(self):
+        if self.driver is not None:
+            return self.driver
+
+        # selenium is only needed for the chrome backend
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
+        start = time.perf_counter()
+        opts = Options()
+        opts.add_argument("--headless")
+        opts.add_argument("--hide-scrollbars")
+        opts.add_argument('--force-device-scale-factor=1')
+        for arg in self.chromeArgs:
+            opts.add_argument(arg)
+        self.driver = webdriver.Chrome(options=opts)
+        try:
+            # the window keeps its size for every page loaded afterwards, so it only has to be measured once
+            self.set_viewport_size(self.driver)
+        except Exception:
+            self.close()
+            raise
+        self.startupTime = time.perf_counter() - start
+        self.logger.info('Browser started in {:.2f} s.'.format(self.startupTime))
+        return self.driver
+
+    def render(self, html, base_url, page):
+        """
+        Shows the HTML markup in the session's browser and returns a screenshot of it as a PIL image, without writing
+        either of them to disk. Relative links in the markup (stylesheets, fonts, images) resolve against base_url.
+        If anything goes wrong the browser is quit, so no Chrome process is left behind, and the next page starts a
+        fresh one.
+        """
+        start = time.perf_counter()
+        try:
+            with self.lock:
+                driver = self.start()
+                self.switch_to_tab(driver, page)
+                if driver.current_url != base_url:
+                    driver.get(base_url)
+                # replace the document in place, it keeps the URL of the page it replaces to resolve relative links with
+                driver.execute_script(WRITE_SCRIPT + READY_SCRIPT, html)
+
+            png = self.capture_when_ready(driver, page)
+        except Exception:
+            self.close()
+            raise
+
+        image = Image.open(io.BytesIO(png))
+        image.load()
+        elapsed = time.perf_counter() - start
+        self.timings.append((page, elapsed))
+        self.logger.info('Screenshot of {} captured in {:.2f} s.'.format(page, elapsed))
+        return image
+
+    def switch_to_tab(self, driver, page):
+        # The first page uses the window the browser was started with, every other page opens a tab of its own
+        if page in self.tabs:
+            driver.switch_to.window(self.tabs[page])
+            return
+        if self.tabs:
+            driver.switch_to.new_window('tab')
+        self.tabs[page] = driver.current_window_handle
+
+    def capture_when_ready(self, driver, page):
+        """
+        Waits until the page is loaded, its fonts are ready and its images are decoded, or ready_timeout has passed,
+        then returns a screenshot of it as PNG data. A page that is not ready by then is still captured, as before when
+        it was given a fixed second. The tab is only checked now and then, so that other threads can use the browser
+        in between.
+        """
+        start = time.perf_counter()
+        while True:
+            with self.lock:
+                self.switch_to_tab(driver, page)
+                ready = driver.execute_script('return window.pageReady === true;')
+                waited = time.perf_counter() - start
+                if ready or waited >= self.readyTimeout:
+                    if ready:
+                        self.logger.info('{} ready after {:.2f} s.'.format(page, waited))
+                    else:
+                        self.logger.info('{} not ready after {:.2f} s, capturing it anyway.'.format(page, waited))
+                    return driver.get_screenshot_as_png()
+            time.sleep(READY_POLL_INTERVAL)
+
+    def close(self):
+        with self.lock:
+            if self.driver is None:
+                return
+            try:
+                self.driver.quit()
+            except Exception as e:
+                self.logger.info('Error while quitting the browser: {}'.format(e))
+            finally:
+                self.driver = None
+                self.tabs = {}
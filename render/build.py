@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This part of the code prepares the HTML templates for the browser. The templates link to the whole of Bootstrap, the
+weather icons stylesheet and several full fonts, while the calendar only uses a small part of them, and Chrome on a Pi
+Zero spends a good while loading and matching all of it for every page. The build step keeps only the CSS rules whose
+selectors can match the markup of a template, subsets the fonts those rules use to the characters that can show up on
+the page and inlines both into a copy of the template, <name>.built.html next to the original one. The copy is built
+again whenever a template, stylesheet or font changes, and the original templates are left as they are for editing.
+
+Subsetting the fonts needs fontTools. Without it, the fonts are linked as they are instead of being inlined.
+"""
+
+import base64
+import io
+import logging
+import os
+import pathlib
+import re
+import threading
+
+# Characters every text font keeps, since event summaries, locations and notes can hold any of them: Latin with its
+# accents and extensions, combining marks, punctuation, currency and letterlike symbols, and arrows
+TEXT_UNICODES = [(0x0020, 0x024F), (0x0300, 0x036F), (0x1E00, 0x1EFF), (0x2000, 0x206F), (0x20A0, 0x20CF),
+                 (0x2100, 0x214F), (0x2190, 0x21FF), (0x25A0, 0x25FF)]
+
+# Folders holding the files the built templates are made of, relative to the render folder
+SOURCE_FOLDERS = ('css', 'font')
+
+STYLESHEET_LINK = re.compile(r'[ \t]*<link\s+rel="stylesheet"\s+href="([^"]+)"\s*/?>\n?')
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def split_rules(css):
+    """
+    Splits a stylesheet into its top level statements, as (prelude, block) pairs. block is the text between the braces
+    of the statement, or None for statements without one, such as @charset or @import.
+    """
+    rules = []
+    start = 0
+    depth = 0
+    quote = None
+    block_start = None
+    i = 0
+    while i < len(css):
+        c = css[i]
+        if quote:
+            if c == '\\':
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c == '{':
+            if depth == 0:
+                block_start = i
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                rules.append((css[start:block_start].strip(), css[block_start + 1:i]))
+                start = i + 1
+        elif c == ';' and depth == 0:
+            rules.append((css[start:i].strip(), None))
+            start = i + 1
+        i += 1
+    return rules
+
+
+def split_selectors(prelude):
+    # Splits a selector list on the commas that are not inside parentheses, as in :not(a, b)
+    selectors = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(prelude):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            selectors.append(prelude[start:i].strip())
+            start = i + 1
+    selectors.append(prelude[start:].strip())
+    return [selector for selector in selectors if selector]
+
+
+class TemplateBuilder:
+
+    def __init__(self):
+        self.logger = logging.getLogger('maginkcal')
+        self.currPath = str(pathlib.Path(__file__).parent.absolute())
+        self.lock = threading.Lock()  # the views rendered in parallel can ask for their templates at the same time
+        self.stats = {}  # sizes before and after the last build of each template
+
+    def get_source_path(self, name):
+        return self.currPath + '/' + name + '_template.html'
+
+    def get_built_path(self, name):
+        return self.currPath + '/' + name + '.built.html'
+
+    def get_sources(self, name):
+        # The template, the stylesheets and fonts it can use, and the code that decides which parts of them are kept
+        sources = [self.get_source_path(name), __file__, self.currPath + '/render.py']
+        for folder in SOURCE_FOLDERS:
+            sources += [entry.path for entry in os.scandir(self.currPath + '/' + folder) if entry.is_file()]
+        return sources
+
+    def is_stale(self, name):
+        try:
+            built_mtime = os.path.getmtime(self.get_built_path(name))
+        except OSError:
+            return True
+        return any(os.path.getmtime(source) > built_mtime for source in self.get_sources(name))
+
+    def get_template_path(self, name):
+        """
+        Returns the path of the built template for the page name, building it first if it is missing or older than
+        anything it is made of. If the build fails, the original template is used.
+        """
+        with self.lock:
+            try:
+                if self.is_stale(name):
+                    self.build(name)
+                return self.get_built_path(name)
+            except Exception as e:
+                self.logger.info('Unable to build the {} template, using it as it is: {}'.format(name, e))
+                return self.get_source_path(name)
+
+    def build(self, name):
+        """
+        Writes the built template for the page name, with its stylesheets pruned to the rules the page can use and
+        inlined, along with the subset of the fonts they need.
+        """
+        with open(self.get_source_path(name), 'r') as file:
+            template = file.read()
+        with open(self.currPath + '/render.py', 'r') as file:
+            # the markup of the events and the classes of the battery icon are added to the page by render.py
+            code = file.read()
+
+        # only the strings of the code can end up in the page
+        markup = template + '\n'.join(text for _, text in re.findall(r'([\'"])(.*?)\1', code))
+        words = set(re.findall(r'[\w-]+', markup))
+        tags = {tag.lower() for tag in re.findall(r'<([a-zA-Z][\w-]*)', markup)} | {'html', 'body'}
+        # classes completed when the page is rendered, such as wi-owm-{current_weather_id}
+        prefixes = tuple({prefix for value in re.findall(r'class="([^"]*)"', template)
+                          for prefix in re.findall(r'([\w-]+)\{', value)})
+
+        css = []
+        stylesheets = STYLESHEET_LINK.findall(template)
+        css_bytes = 0
+        for href in stylesheets:
+            path = os.path.join(self.currPath, href)
+            with open(path, 'r', encoding='utf-8') as file:
+                text = file.read()
+            css_bytes += len(text.encode())
+            text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+            css.append(self.prune(text, os.path.dirname(path), words, tags, prefixes))
+
+        kept = self.link_keyframes(''.join(rules for rules, _ in css))
+        unicodes = self.get_unicodes(markup, kept)
+        font_faces = []
+        font_bytes = [0, 0]
+        for _, faces in css:
+            for block, folder in faces:
+                face = self.build_font_face(block, folder, kept, unicodes, font_bytes)
+                if face:
+                    font_faces.append(face)
+        style = '\n'.join(font_faces + [kept])
+
+        # the built template goes through the same placeholders as the original, so the braces of the CSS are doubled
+        style_tag = '<style>\n' + style.replace('{', '{{').replace('}', '}}') + '\n</style>\n'
+        links = list(STYLESHEET_LINK.finditer(template))
+        built = template
+        if links:
+            built = (template[:links[0].start()] + style_tag +
+                     ''.join(template[a.end():b.start()] for a, b in zip(links, links[1:])) +
+                     template[links[-1].end():])
+
+        built_path = self.get_built_path(name)
+        tmp_path = '{}.{}.tmp'.format(built_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(built)
+        os.replace(tmp_path, built_path)
+
+        self.stats[name] = dict(css_before=css_bytes, css_after=len(style.encode()), font_before=font_bytes[0],
+                                font_after=font_bytes[1], template=len(built.encode()))
+        self.logger.info('Built the {} template: CSS {:.0f} KB -> {:.0f} KB, fonts {:.0f} KB -> {:.0f} KB.'.format(
+            name, css_bytes / 1024, len(style.encode()) / 1024, font_bytes[0] / 1024, font_bytes[1] / 1024))
+
+    def prune(self, css, folder, words, tags, prefixes):
+        """
+        Returns the rules of the stylesheet css that can apply to the page, as text, and the blocks of its @font-face
+        rules, with the folder of the stylesheet to resolve their URLs against.
+        """
+        rules = []
+        faces = []
+        for prelude, block in split_rules(css):
+            if block is None:
+                continue  # @charset and the like, the page is already UTF-8
+            keyword = prelude.split(None, 1)[0].lower() if prelude.startswith('@') else None
+            if keyword in ('@media', '@supports'):
+                if keyword == '@media' and re.fullmatch(r'@media\s+print', prelude):
+                    continue
+                inner, inner_faces = self.prune(block, folder, words, tags, prefixes)
+                if inner:
+                    rules.append(prelude + '{' + inner + '}')
+                faces += inner_faces
+            elif keyword == '@font-face':
+                faces.append((block, folder))
+            elif keyword is not None and keyword.endswith('keyframes'):
+                # kept for now, dropped by link_keyframes unless a kept rule animates with them
+                rules.append(prelude + '{' + block + '}')
+            elif keyword is None:
+                selectors = [selector for selector in split_selectors(prelude)
+                             if self.is_used(selector, words, tags, prefixes)]
+                if selectors:
+                    rules.append(','.join(selectors) + '{' + self.rebase_urls(block.strip(), folder) + '}')
+        return ''.join(rules), faces
+
+    def is_used(self, selector, words, tags, prefixes):
+        # Whether selector can match the page: every class, id and element it names has to appear in the markup
+        selector = re.sub(r'\[[^\]]*\]', '', selector)
+        selector = re.sub(r'::?[\w-]+(\([^)]*\))?', '', selector)
+        for name in re.findall(r'[.#](-?[_a-zA-Z][\w-]*)', selector):
+            if name not in words and not name.startswith(prefixes):
+                return False
+        selector = re.sub(r'[.#]-?[_a-zA-Z][\w-]*', ' ', selector)
+        return all(tag.lower() in tags for tag in re.findall(r'[a-zA-Z][\w-]*', selector))
+
+    def link_keyframes(self, css):
+        # Drops the @keyframes no kept rule refers to
+        used = []
+        for prelude, block in split_rules(css):
+            if prelude.startswith('@') and prelude.split(None, 1)[0].endswith('keyframes'):
+                continue
+            used.append(block or '')
+        used = ' '.join(used)
+        out = []
+        for prelude, block in split_rules(css):
+            if prelude.startswith('@') and prelude.split(None, 1)[0].endswith('keyframes'):
+                if not re.search(r'(?<![\w-])' + re.escape(prelude.split(None, 1)[1].strip()) + r'(?![\w-])', used):
+                    continue
+            out.append(prelude + ('{' + block + '}' if block is not None else ';'))
+        return '\n'.join(out)
+
+    def rebase_urls(self, block, folder):
+        # URLs in the stylesheets are relative to the css folder, in the template they are relative to the render folder
+        def rebase(match):
+            url = match.group(2)
+            if re.match(r'^(data:|[a-z]+://|/|#)', url):
+                return match.group(0)
+            return 'url("' + os.path.relpath(os.path.join(folder, url), self.currPath) + '")'
+        return CSS_URL.sub(rebase, block)
+
+    def get_unicodes(self, markup, css):
+        # Characters the fonts have to keep: text, the characters written in the templates and the icons of the CSS
+        unicodes = set()
+        for first, last in TEXT_UNICODES:
+            unicodes.update(range(first, last + 1))
+        unicodes.update(ord(c) for c in markup if ord(c) > 0x7E)
+        for content in re.findall(r'content:\s*(["\'])(.*?)\1', css):
+            for escaped, plain in re.findall(r'\\([0-9a-fA-F]{1,6})\s?|(.)', content[1]):
+                unicodes.add(int(escaped, 16) if escaped else ord(plain))
+        return unicodes
+
+    def build_font_face(self, block, folder, css, unicodes, font_bytes):
+        """
+        Returns the @font-face rule for block with its font subset to unicodes and inlined, or None if no kept rule
+        uses the font or its file does not exist, in which case the browser would not have loaded it either.
+        """
+        family = re.search(r'font-family\s*:\s*([\'"]?)([^;\'"]+)\1', block)
+        if not family or not re.search(r'font-family\s*:[^;}]*' + re.escape(family.group(2)), css):
+            return None
+
+        # Chrome loads the first source it can use, any of them has the same glyphs, and fontTools reads TrueType
+        paths = [os.path.join(folder, re.split(r'[?#]', url)[0]) for _, url in CSS_URL.findall(block)]
+        paths = [path for path in paths if os.path.isfile(path)]
+        if not paths:
+            self.logger.info('Font for {} not found, leaving it out.'.format(family.group(2)))
+            return None
+        loaded = next((path for path in paths if path.endswith(('.woff2', '.woff', '.ttf', '.otf'))), paths[0])
+        path = next((path for path in paths if path.endswith(('.ttf', '.otf'))), loaded)
+        font_bytes[0] += os.path.getsize(loaded)
+
+        descriptors = [declaration.strip() for declaration in block.split(';')
+                       if declaration.strip() and not re.match(r'\s*src\s*:', declaration)]
+        try:
+            from fontTools import subset
+        except ImportError:
+            src = 'url("{}")'.format(os.path.relpath(loaded, self.currPath))
+            return '@font-face{' + ';'.join(descriptors + ['src:' + src]) + '}'
+
+        # fontTools reports every table it prunes or drops and every character a font does not have
+        logging.getLogger('fontTools').setLevel(logging.ERROR)
+        options = subset.Options()
+        options.flavor = 'woff'
+        options.notdef_outline = True
+        font = subset.load_font(path, options)
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=unicodes)
+        subsetter.subset(font)
+        data = io.BytesIO()
+        subset.save_font(font, data, options)
+        font.close()
+        font_bytes[1] += len(data.getvalue())
+
+        src = 'url(data:font/woff;base64,{}) format("woff")'.format(base64.b64encode(data.getvalue()).decode())
+        return '@font-face{' + ';'.join(descriptors + ['src:' + src]) + '}'
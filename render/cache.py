@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This part of the code keeps the screenshots of recently rendered pages on disk, keyed by a hash of their HTML and of the
+stylesheets, fonts and images they use. When the events, weather and battery level have not changed since an earlier
+run, the page is byte-identical and its screenshot is taken from the cache without starting the browser at all. The
+least recently used screenshots are evicted once the cache grows past its size limit.
+"""
+
+import hashlib
+import logging
+import os
+import pathlib
+from PIL import Image
+
+# Files the rendered pages depend on besides their HTML, relative to the render folder
+ASSET_PATTERNS = ('*_template.html', 'battery.png', 'background.jpg', 'css/*', 'font/*')
+
+
+class RenderCache:
+
+    def __init__(self, max_bytes=20 * 1024 * 1024, cache_dir=None):
+        self.logger = logging.getLogger('maginkcal')
+        self.currPath = str(pathlib.Path(__file__).parent.absolute())
+        self.cacheDir = cache_dir or self.currPath + '/cache'
+        self.maxBytes = max_bytes
+        self.assetDigest = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_asset_digest(self):
+        # Name, size and modification time of every asset, so that editing a stylesheet or font invalidates the cache
+        if self.assetDigest is None:
+            digest = hashlib.sha256()
+            root = pathlib.Path(self.currPath)
+            for pattern in ASSET_PATTERNS:
+                for path in sorted(root.glob(pattern)):
+                    if path.is_file():
+                        stat = path.stat()
+                        digest.update('{}:{}:{}\n'.format(path.relative_to(root), stat.st_size, stat.st_mtime_ns).encode())
+            self.assetDigest = digest.hexdigest()
+        return self.assetDigest
+
+    def get_key(self, html, *settings):
+        """
+        Returns the cache key of a page, from its HTML, the assets it uses and anything else that changes the
+        screenshot, such as the size of the browser window.
+        """
+        digest = hashlib.sha256(self.get_asset_digest().encode())
+        digest.update(repr(settings).encode())
+        digest.update(html.encode())
+        return digest.hexdigest()
+
+    def get_file(self, key):
+        return os.path.join(self.cacheDir, key + '.png')
+
+    def get(self, key, page):
+        """
+        Returns the cached screenshot for key as a PIL image, or None if there is none.
+        """
+        cache_file = self.get_file(key)
+        try:
+            image = Image.open(cache_file)
+            image.load()
+        except (OSError, ValueError):
+            self.misses += 1
+            self.logger.info('Render cache miss for {} ({} hits, {} misses).'.format(page, self.hits, self.misses))
+            return None
+
+        # mark as recently used, eviction goes by modification time
+        try:
+            os.utime(cache_file)
+        except OSError:
+            pass
+        self.hits += 1
+        self.logger.info('Render cache hit for {} ({} hits, {} misses).'.format(page, self.hits, self.misses))
+        return image
+
+    def put(self, key, image):
+        cache_file = self.get_file(key)
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            tmp_file = cache_file + '.tmp'
+            # screenshots are mostly flat colors, so light compression is enough and keeps saving quick
+            image.save(tmp_file, 'PNG', compress_level=1)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            self.logger.info('Unable to cache screenshot: {}'.format(e))
+            return
+        self.evict()
+
+    def evict(self):
+        # Removes the least recently used screenshots until the cache fits in max_bytes
+        try:
+            entries = []
+            for entry in os.scandir(self.cacheDir):
+                if entry.is_file() and entry.name.endswith('.png'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
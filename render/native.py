@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This is the native alternative to rendering the calendar through headless Chrome. It lays out the month view and the
+day view directly with Pillow, using the fonts bundled in the "render/font" folder, and follows the look of the HTML
+templates and their stylesheets. It is much faster and lighter than Chrome on a Pi Zero, but any change made to the
+templates or CSS has to be mirrored here by hand.
+"""
+
+import re
+import pathlib
+from datetime import timedelta
+from PIL import Image, ImageDraw, ImageFont
+
+# Colors of the stylesheets
+COLORS = {
+    'text': '#212529',
+    'dashText': '#333333',
+    'danger': '#dc3545',
+    'muted': '#6c757d',
+    'today': '#ff0000',
+    'icon': '#808080',
+}
+
+# Colors the panel can show as they are, as in css/palette.css, used when rendering with isPaletteNative
+PALETTE_COLORS = {
+    'text': '#000000',
+    'dashText': '#000000',
+    'danger': '#ff0000',
+    'muted': '#0000ff',
+    'today': '#ff0000',
+    'icon': '#0000ff',
+}
+
+# Offset of each battery level within the battery.png sprite, as in the stylesheets
+BATTERY_SPRITE_TOP = {
+    'battery80': 0,
+    'battery60': 44,
+    'battery40': 89,
+    'battery20': 134,
+    'battery0': 178,
+}
+
+
+class NativeRenderer:
+
+    def __init__(self, width, height, palette_native=False):
+        self.currPath = str(pathlib.Path(__file__).parent.absolute())
+        self.imageWidth = width
+        self.imageHeight = height
+        self.paletteNative = palette_native  # draw only in the panel's colors, with text that is not anti-aliased
+        self.colors = PALETTE_COLORS if palette_native else COLORS
+        self.fonts = {}
+        self.weatherGlyphs = None
+
+    def get_font(self, name, size):
+        if (name, size) not in self.fonts:
+            self.fonts[(name, size)] = ImageFont.truetype(self.currPath + '/font/' + name + '.ttf', size)
+        return self.fonts[(name, size)]
+
+    def get_weather_glyph(self, weather_id):
+        # Map OpenWeatherMap condition ids to glyphs the same way the weather icons stylesheet does
+        if self.weatherGlyphs is None:
+            with open(self.currPath + '/css/weather-icons.min.css', 'r') as file:
+                css = file.read()
+            self.weatherGlyphs = {owm_id: chr(int(code, 16))
+                                  for owm_id, code in re.findall(r'\.wi-owm-(\d+):before\{content:"\\(f[0-9a-f]+)"\}', css)}
+        return self.weatherGlyphs.get(str(weather_id), '')
+
+    def wrap_text(self, text, font, max_width):
+        # Breaks text into lines that fit max_width, splitting words that are too long on their own
+        lines = []
+        line = ''
+        for word in text.split():
+            candidate = word if not line else line + ' ' + word
+            if font.getlength(candidate) <= max_width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            while font.getlength(word) > max_width and len(word) > 1:
+                cut = len(word) - 1
+                while cut > 1 and font.getlength(word[:cut]) > max_width:
+                    cut -= 1
+                lines.append(word[:cut])
+                word = word[cut:]
+            line = word
+        if line:
+            lines.append(line)
+        return lines or ['']
+
+    def ellipsize(self, text, font, max_width):
+        # Cuts text to fit max_width, ending it with an ellipsis if it had to be shortened
+        if font.getlength(text) <= max_width:
+            return text
+        while text and font.getlength(text + '…') > max_width:
+            text = text[:-1]
+        return text + '…'
+
+    def draw_battery(self, image, batt_text):
+        if batt_text not in BATTERY_SPRITE_TOP:
+            return
+        sprite = Image.open(self.currPath + '/battery.png').convert('RGBA')
+        top = BATTERY_SPRITE_TOP[batt_text]
+        icon = sprite.crop((0, top, 53, top + 27))
+        mask = icon
+        if self.paletteNative:
+            # blending the soft edges of the icon into the background would give shades the panel does not have
+            mask = icon.getchannel('A').point(lambda alpha: 255 if alpha >= 128 else 0)
+        image.paste(icon, (self.imageWidth - 15 - 53, 5), mask)
+
+    def new_image(self):
+        image = Image.new('RGB', (self.imageWidth, self.imageHeight), 'white')
+        draw = ImageDraw.Draw(image)
+        if self.paletteNative:
+            draw.fontmode = '1'
+        return image, draw
+
+    def draw_marker(self, draw, x, y, size, pointing_right, color):
+        # Stands in for the ► and ◄ characters used by the HTML calendar, which the bundled fonts do not have
+        if pointing_right:
+            points = [(x, y), (x + size, y + size / 2), (x, y + size)]
+        else:
+            points = [(x + size, y), (x, y + size / 2), (x + size, y + size)]
+        draw.polygon(points, fill=color)
+
+    def draw_month(self, cal_dict, cal_list, month_name, batt_text, get_short_time):
+        """
+        Draws the 5 week month view, cal_list holding the events to show on each of the 35 days.
+        """
+        image, draw = self.new_image()
+        padding = 16
+        col_width = (self.imageWidth - 2 * padding) / 7
+        max_events_per_day = cal_dict['maxEventsPerDay']
+        day_of_week_text = cal_dict['dayOfWeekText']
+        week_start_day = cal_dict['weekStartDay']
+
+        # Month header
+        y = padding
+        draw.text((self.imageWidth / 2, y + 104), month_name.upper(), font=self.get_font('Quattrocento-Bold', 208),
+                  fill=self.colors['text'], anchor='mm')
+        y += 208
+
+        # Day of week row
+        y += 16
+        font = self.get_font('Quattrocento-Bold', 56)
+        for i in range(7):
+            x = padding + col_width * (i + 0.5)
+            draw.text((x, y + 33), day_of_week_text[(i + week_start_day) % 7].upper(), font=font,
+                      fill=self.colors['text'], anchor='mm')
+        y += 67 + 32 + 16
+
+        # Dates and events, rows grow if their events need more than the minimum height
+        date_font = self.get_font('Quattrocento-Bold', 48)
+        event_font = self.get_font('Lexend-Regular', 16)
+        line_height = 24
+        for week in range(5):
+            row_top = y
+            row_bottom = y + 184
+            for weekday in range(7):
+                i = week * 7 + weekday
+                curr_date = cal_dict['calStartDate'] + timedelta(days=i)
+                x = padding + col_width * weekday
+                center = x + col_width / 2
+                cell_y = row_top + 8
+
+                if curr_date == cal_dict['today']:
+                    draw.ellipse((center - 32, cell_y, center + 32, cell_y + 64), fill=self.colors['today'])
+                    draw.text((center, cell_y + 32), str(curr_date.day), font=date_font, fill='white', anchor='mm')
+                    cell_y += 64 + 8
+                else:
+                    color = self.colors['muted'] if curr_date.month != cal_dict['today'].month else self.colors['text']
+                    draw.text((center, cell_y + 24), str(curr_date.day), font=date_font, fill=color, anchor='mm')
+                    cell_y += 48 + 8
+
+                for event in cal_list[i][:max_events_per_day]:
+                    if event['isUpdated']:
+                        color = self.colors['danger']
+                    elif curr_date.month != cal_dict['today'].month:
+                        color = self.colors['muted']
+                    else:
+                        color = self.colors['text']
+
+                    text_x = x + 2
+                    text_width = col_width - 4
+                    if event['isMultiday']:
+                        self.draw_marker(draw, text_x, cell_y + 7, 10, event['startDatetime'].date() == curr_date, color)
+                        text = event['summary']
+                        text_x += 13
+                        text_width -= 13
+                    elif event['allday']:
+                        text = event['summary']
+                    else:
+                        text = get_short_time(event['startDatetime'], cal_dict['is24hour']) + ' ' + event['summary']
+
+                    for line in self.wrap_text(text, event_font, text_width):
+                        draw.text((text_x, cell_y + line_height / 2), line, font=event_font, fill=color, anchor='lm')
+                        cell_y += line_height
+                    cell_y += 1
+
+                if len(cal_list[i]) > max_events_per_day:
+                    draw.text((x + 2, cell_y + line_height / 2), str(len(cal_list[i]) - max_events_per_day) + ' more',
+                              font=event_font, fill=self.colors['muted'], anchor='lm')
+                    cell_y += line_height
+
+                row_bottom = max(row_bottom, cell_y)
+            y = row_bottom
+
+        self.draw_battery(image, batt_text)
+        return image
+
+    def draw_daily(self, fields, events, get_short_time):
+        """
+        Draws the day view. fields holds the same values that are filled into the dashboard template and events
+        the list of events to show under "Upcoming Events".
+        """
+        image, draw = self.new_image()
+        left = 30
+        content_width = self.imageWidth - 2 * left
+        quarter = content_width / 4
+
+        # Big date, weekday and month
+        draw.text((left + quarter - 15, 0), fields['day'], font=self.get_font('TiltWarp-Regular', 180),
+                  fill=self.colors['dashText'], anchor='ra')
+        font = self.get_font('Lexend-Regular', 50)
+        draw.text((left + quarter + 15, 55 + 10), fields['weekday'], font=font, fill=self.colors['dashText'], anchor='la')
+        draw.text((left + quarter + 15, 55 + 10 + 71), fields['month'], font=font, fill=self.colors['dashText'],
+                  anchor='la')
+
+        # Big weather icon with the current weather
+        center = left + 3 * quarter
+        glyph = self.get_weather_glyph(fields['current_weather_id'])
+        icon_font = self.get_font('weathericons-regular-webfont', 250)
+        draw.text((center, 20), glyph, font=icon_font, fill=self.colors['dashText'], anchor='ma')
+        # the icon font's glyphs reach below their line box, keep the text clear of the drawn icon
+        y = max(20 + 250, draw.textbbox((center, 20), glyph, font=icon_font, anchor='ma')[3]) + 20
+        draw.text((center, y), '{} | {}°'.format(fields['current_weather_text'], fields['current_weather_temp']),
+                  font=self.get_font('Lexend-Regular', 30), fill=self.colors['dashText'], anchor='ma')
+        y += 33 + 10 + 50
+
+        # Forecast for the next 6 hours
+        col_width = content_width / 6
+        font = self.get_font('Lexend-Regular', 24)
+        icon_font = self.get_font('weathericons-regular-webfont', 100)
+        for i in range(6):
+            center = left + col_width * (i + 0.5)
+            draw.text((center, y + 20), fields['hour{}'.format(i)], font=font, fill=self.colors['dashText'], anchor='ma')
+            draw.text((center, y + 60), self.get_weather_glyph(fields['hour{}_weather_id'.format(i)]), font=icon_font,
+                      fill=self.colors['icon'], anchor='ma')
+            draw.text((center, y + 200), '{}% | {}°'.format(fields['hour{}_weather_pop'.format(i)],
+                                                             fields['hour{}_weather_temp'.format(i)]),
+                      font=font, fill=self.colors['dashText'], anchor='ma')
+        y += 200 + 27 + 10
+
+        # Upcoming events
+        x = left + 100
+        y += 60 + 20
+        draw.text((x, y), 'Upcoming Events:', font=self.get_font('Lexend-Regular', 36), fill=self.colors['dashText'],
+                  anchor='la', stroke_width=1, stroke_fill=self.colors['dashText'])
+        y += 40 + 10 + 50
+
+        font = self.get_font('Lexend-Regular', 25)
+        max_width = (self.imageWidth - x - left) * 0.95
+        for event in events:
+            title = '{} - {} : {}'.format(get_short_time(event['startDatetime']), get_short_time(event['endDatetime']),
+                                          event['summary'])
+            draw.text((x + 10, y + 18), '•', font=font, fill=self.colors['dashText'], anchor='mm')
+            draw.text((x + 30, y), self.ellipsize(title, font, max_width - 30), font=font, fill=self.colors['dashText'],
+                      anchor='la', stroke_width=1, stroke_fill=self.colors['dashText'])
+            y += 36
+            for detail in ('Location: ' + event['location'], 'Notes: ' + event['description']):
+                draw.text((x + 125, y), self.ellipsize(detail, font, max_width - 125), font=font,
+                          fill=self.colors['dashText'], anchor='la')
+                y += 36
+            y += 36
+
+        self.draw_battery(image, fields['battText'])
+        return image
@@ -11,67 +11,167 @@ calendar and refreshing of the eInk display. In the future, I might choose to ge
 RPi device, while using a ESP32 or PiZero purely to just retrieve the image from a file host and update the screen.
 """
 
+import os
 import string
 import pathlib
 import logging
-import datetime
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from time import sleep
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import timedelta
 from PIL import Image
+from display.quantizer import Quantizer
+from render.browser import BrowserSession
+from render.build import TemplateBuilder
+from render.cache import RenderCache
+from render.native import NativeRenderer
+from render.template import escape, load_template
+
+
+def render_native_view(width, height, angle, palette_native, method, args):
+    # Runs in a worker process of RenderHelper.render_views, which draws each view with its own renderer
+    render_service = RenderHelper(width, height, angle, 'native', cache_size=0, palette_native=palette_native)
+    return getattr(render_service, method)(*args)
+
 
 class RenderHelper:
 
-    def __init__(self, width, height, angle):
+    def __init__(self, width, height, angle, backend='chrome', ready_timeout=10, keep_artifacts=False,
+                 cache_size=0, palette_native=False, optimize_templates=True):
         self.logger = logging.getLogger('maginkcal')
         self.currPath = str(pathlib.Path(__file__).parent.absolute())
         self.imageWidth = width
         self.imageHeight = height
         self.rotateAngle = angle
-
-    def set_viewport_size(self, driver):
-
-        # Extract the current window size from the driver
-        current_window_size = driver.get_window_size()
-
-        # Extract the client window size from the html tag
-        html = driver.find_element(By.TAG_NAME,'html')
-        inner_width = int(html.get_attribute("clientWidth"))
-        inner_height = int(html.get_attribute("clientHeight"))
-
-        # "Internal width you want to set+Set "outer frame width" to window size
-        target_width = self.imageWidth + (current_window_size["width"] - inner_width)
-        target_height = self.imageHeight + (current_window_size["height"] - inner_height)
-
-        driver.set_window_rect(
-            width=target_width,
-            height=target_height)
-
-    def get_screenshot(self, name="calendar"):
-        opts = Options()
-        opts.add_argument("--headless")
-        opts.add_argument("--hide-scrollbars")
-        opts.add_argument('--force-device-scale-factor=1')
-        driver = webdriver.Chrome(options=opts)
-
-        self.set_viewport_size(driver)
-        driver.get('file://' + self.currPath + '/' + name + '.html')
-        sleep(1)
-        screenshot_path = self.currPath + '/' + name + ".png"
-        driver.get_screenshot_as_file(screenshot_path)
-        driver.quit()
-
-        self.logger.info('Screenshot captured and saved to file.')
-
-        # Load full-color image and rotate it
-        color_img = Image.open(screenshot_path).convert("RGB")
+        self.backend = backend  # chrome: screenshot the HTML templates / native: draw the views with Pillow
+        self.paletteNative = palette_native  # only use the panel's own colors, so the display does not need to dither
+        self.nativeRenderer = NativeRenderer(width, height, palette_native)
+        self.panelPalette = None
+        self.browser = None  # headless Chrome session shared by all the views rendered with the chrome backend
+        self.browserLock = threading.Lock()
+        self.readyTimeout = ready_timeout  # longest wait for fonts and images to load before taking a screenshot
+        self.keepArtifacts = keep_artifacts  # also write the generated HTML and the screenshots to disk, for debugging
+        self.cache = RenderCache(cache_size) if cache_size > 0 else None  # screenshots of recently rendered pages
+        # templates with only the CSS and font glyphs they use, inlined, so the browser has less to load and match
+        self.templateBuilder = TemplateBuilder() if optimize_templates else None
+
+    def get_template_path(self, name):
+        if self.templateBuilder is not None:
+            return self.templateBuilder.get_template_path(name)
+        return self.currPath + '/' + name + '_template.html'
+
+    def get_screenshot(self, html, name="calendar"):
+        if self.paletteNative:
+            html = html.replace('</head>', '<link rel="stylesheet" href="css/palette.css">\n</head>', 1)
+        if self.keepArtifacts:
+            with open(self.currPath + '/' + name + '.html', 'w') as html_file:
+                html_file.write(html)
+
+        # An unchanged page gives the same screenshot as last time, so the browser is not needed for it
+        cache_key = None
+        color_img = None
+        if self.cache is not None:
+            cache_key = self.cache.get_key(html, name, self.imageWidth, self.imageHeight)
+            color_img = self.cache.get(cache_key, name)
+
+        if color_img is None:
+            # The browser is started on the first screenshot and reused for the next ones, until close() is called
+            with self.browserLock:
+                if self.browser is None:
+                    # LCD text would color the edges of letters with shades the panel does not have
+                    chrome_args = ['--disable-lcd-text'] if self.paletteNative else []
+                    self.browser = BrowserSession(self.imageWidth, self.imageHeight, self.readyTimeout, chrome_args)
+            # the page is shown in place of its template, so that the stylesheets, fonts and images it links to are found
+            color_img = self.browser.render(html, 'file://' + self.get_template_path(name), name)
+            self.logger.info('Screenshot captured.')
+            if self.cache is not None:
+                self.cache.put(cache_key, color_img)
+        if self.keepArtifacts:
+            color_img.save(self.currPath + '/' + name + '.png')
+
+        # Convert the full-color image and rotate it
+        return self.process_image(color_img.convert("RGB"))
+
+    def render_views(self, views):
+        """
+        Starts rendering several views at the same time and returns an iterator of (name, image), giving each view as
+        soon as it is done, so the first view can be sent to the display while the others are still being rendered.
+        views is a list of (name, method, args), method being the name of the generate method to call with args, e.g.
+        ('month', 'generateMonthCal', (cal_dict,)).
+
+        With the chrome backend each view is loaded in its own tab of the shared browser. The native backend draws
+        each view in a separate process, since drawing with Pillow holds on to the GIL.
+        """
+        workers = len(views)
+        if self.backend == 'native':
+            # the browser does its work in processes of its own, but native views need a core each
+            workers = min(workers, os.cpu_count() or 1)
+        if workers < 2:
+            return ((name, getattr(self, method)(*args)) for name, method, args in views)
+
+        if self.backend == 'native':
+            executor = ProcessPoolExecutor(max_workers=workers)
+            futures = {executor.submit(render_native_view, self.imageWidth, self.imageHeight, self.rotateAngle,
+                                       self.paletteNative, method, args): name for name, method, args in views}
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+            futures = {executor.submit(getattr(self, method), *args): name for name, method, args in views}
+        # the views are already on their way, the workers go away once they are done with them
+        executor.shutdown(wait=False)
+
+        def completed():
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                # do not leave the remaining views rendering if the caller stops early or a view failed
+                for future in futures:
+                    future.cancel()
+
+        return completed()
+
+    def get_timings(self):
+        # (page, seconds) for each screenshot taken so far, not counting the browser startup
+        return list(self.browser.timings) if self.browser else []
+
+    def close(self):
+        # Quits the browser, if one was started
+        if self.browser is not None:
+            self.browser.close()
+
+    def process_image(self, color_img):
+        if self.paletteNative:
+            # Snap whatever anti-aliasing is left, e.g. around the text drawn by the browser, to the nearest panel
+            # color. The result is a palette image the display can show without quantizing it.
+            if self.panelPalette is None:
+                self.panelPalette = Quantizer(dither='none').get_palette_image()
+            color_img = color_img.quantize(palette=self.panelPalette, dither=Image.Dither.NONE)
         color_img = color_img.rotate(self.rotateAngle, expand=True)
 
         self.logger.info('Full-color image processed.')
         return color_img
 
+    def get_battery_text(self, batt_level, battery_display_mode):
+        # batteryDisplayMode - 0: do not show / 1: always show / 2: show when battery is low
+        if battery_display_mode == 0:
+            batt_text = 'batteryHide'
+        elif battery_display_mode == 1:
+            if batt_level >= 80:
+                batt_text = 'battery80'
+            elif batt_level >= 60:
+                batt_text = 'battery60'
+            elif batt_level >= 40:
+                batt_text = 'battery40'
+            elif batt_level >= 20:
+                batt_text = 'battery20'
+            else:
+                batt_text = 'battery0'
+
+        elif battery_display_mode == 2 and batt_level < 20.0:
+            batt_text = 'battery0'
+        elif battery_display_mode == 2 and batt_level >= 20.0:
+            batt_text = 'batteryHide'
+        return batt_text
+
     def get_day_in_cal(self, startDate, eventDate):
         delta = eventDate - startDate
         return delta.days
@@ -95,209 +195,145 @@ class RenderHelper:
         return datetime_str
 
     def generateMonthCal(self, cal_dict):
-        # calDict = {'eventsMonthCal': eventList, 'calStartDate': calStartDate, 'today': currDate, 'lastRefresh': currDatetime, 'batteryLevel': batteryLevel}
-        # first setup list to represent the 5 weeks in our calendar
-        cal_list = []
-        for i in range(35):
-            cal_list.append([])
+        # calDict = {'eventIndex': EventIndex, 'calStartDate': calStartDate, 'today': currDate, 'lastRefresh': currDatetime, 'batteryLevel': batteryLevel}
+        # the events on each day of the 5 weeks in our calendar, multi-day events on every day they are on
+        cal_list = cal_dict['eventIndex'].get_days(cal_dict['calStartDate'], 35)
 
         # retrieve calendar configuration
-        max_events_per_day = cal_dict['maxEventsPerDay']
         battery_display_mode = cal_dict['batteryDisplayMode']
-        day_of_week_text = cal_dict['dayOfWeekText']
-        week_start_day = cal_dict['weekStartDay']
-        is24hour = cal_dict['is24hour']
-
-        # for each item in the eventList, add them to the relevant day in our calendar list
-        for event in cal_dict['eventsMonthCal']:
-            idx = self.get_day_in_cal(cal_dict['calStartDate'], event['startDatetime'].date())
-            if idx >= 0:
-                cal_list[idx].append(event)
-            if event['isMultiday']:
-                idx = self.get_day_in_cal(cal_dict['calStartDate'], event['endDatetime'].date())
-                if idx < len(cal_list):
-                    cal_list[idx].append(event)
-
-        # Read html template
-        with open(self.currPath + '/calendar_template.html', 'r') as file:
-            calendar_template = file.read()
 
         # Insert month header
         month_name = str(cal_dict['today'].month)
 
         # Insert battery icon
-        # batteryDisplayMode - 0: do not show / 1: always show / 2: show when battery is low
-        batt_level = cal_dict['batteryLevel']
+        batt_text = self.get_battery_text(cal_dict['batteryLevel'], battery_display_mode)
 
-        if battery_display_mode == 0:
-            batt_text = 'batteryHide'
-        elif battery_display_mode == 1:
-            if batt_level >= 80:
-                batt_text = 'battery80'
-            elif batt_level >= 60:
-                batt_text = 'battery60'
-            elif batt_level >= 40:
-                batt_text = 'battery40'
-            elif batt_level >= 20:
-                batt_text = 'battery20'
-            else:
-                batt_text = 'battery0'
+        if self.backend == 'native':
+            calendar_image = self.nativeRenderer.draw_month(cal_dict, cal_list, month_name, batt_text, self.get_short_time)
+            return self.process_image(calendar_image)
 
-        elif battery_display_mode == 2 and batt_level < 20.0:
-            batt_text = 'battery0'
-        elif battery_display_mode == 2 and batt_level >= 20.0:
-            batt_text = 'batteryHide'
+        calendar_html = self.get_month_html(cal_dict, cal_list, month_name, batt_text)
+        calendar_image = self.get_screenshot(calendar_html, "calendar")
+        return calendar_image
+
+    def get_month_html(self, cal_dict, cal_list, month_name, batt_text):
+        """
+        Returns the HTML of the month view, cal_list holding the events to show on each of the 35 days.
+        """
+        max_events_per_day = cal_dict['maxEventsPerDay']
+        day_of_week_text = cal_dict['dayOfWeekText']
+        week_start_day = cal_dict['weekStartDay']
+        is24hour = cal_dict['is24hour']
 
         # Populate the day of week row
-        cal_days_of_week = ''
+        cal_days_of_week = []
         for i in range(0, 7):
-            cal_days_of_week += '<li class="font-weight-bold text-uppercase">' + day_of_week_text[
-                (i + week_start_day) % 7] + "</li>\n"
+            cal_days_of_week.append('<li class="font-weight-bold text-uppercase">' + escape(day_of_week_text[
+                (i + week_start_day) % 7]) + "</li>\n")
 
         # Populate the date and events
-        cal_events_text = ''
+        cal_events_text = []
         for i in range(len(cal_list)):
             curr_date = cal_dict['calStartDate'] + timedelta(days=i)
             day_of_month = curr_date.day
+            is_other_month = curr_date.month != cal_dict['today'].month
             if curr_date == cal_dict['today']:
-                cal_events_text += '<li><div class="datecircle">' + str(day_of_month) + '</div>\n'
-            elif curr_date.month != cal_dict['today'].month:
-                cal_events_text += '<li><div class="date text-muted">' + str(day_of_month) + '</div>\n'
+                cal_events_text.append('<li><div class="datecircle">' + str(day_of_month) + '</div>\n')
+            elif is_other_month:
+                cal_events_text.append('<li><div class="date text-muted">' + str(day_of_month) + '</div>\n')
             else:
-                cal_events_text += '<li><div class="date">' + str(day_of_month) + '</div>\n'
+                cal_events_text.append('<li><div class="date">' + str(day_of_month) + '</div>\n')
 
-            for j in range(min(len(cal_list[i]), max_events_per_day)):
-                event = cal_list[i][j]
-                cal_events_text += '<div class="event'
+            for event in cal_list[i][:max_events_per_day]:
                 if event['isUpdated']:
-                    cal_events_text += ' text-danger'
-                elif curr_date.month != cal_dict['today'].month:
-                    cal_events_text += ' text-muted'
+                    event_class = 'event text-danger'
+                elif is_other_month:
+                    event_class = 'event text-muted'
+                else:
+                    event_class = 'event'
                 if event['isMultiday']:
                     if event['startDatetime'].date() == curr_date:
-                        cal_events_text += '">►' + event['summary']
+                        event_text = '►' + escape(event['summary'])
                     else:
                         # calHtmlList.append(' text-multiday">')
-                        cal_events_text += '">◄' + event['summary']
+                        event_text = '◄' + escape(event['summary'])
                 elif event['allday']:
-                    cal_events_text += '">' + event['summary']
+                    event_text = escape(event['summary'])
                 else:
-                    cal_events_text += '">' + self.get_short_time(event['startDatetime'], is24hour) + ' ' + event[
-                        'summary']
-                cal_events_text += '</div>\n'
+                    event_text = self.get_short_time(event['startDatetime'], is24hour) + ' ' + escape(event['summary'])
+                cal_events_text.append('<div class="' + event_class + '">' + event_text + '</div>\n')
             if len(cal_list[i]) > max_events_per_day:
-                cal_events_text += '<div class="event text-muted">' + str(len(cal_list[i]) - max_events_per_day) + ' more'
+                cal_events_text.append('<div class="event text-muted">' + str(len(cal_list[i]) - max_events_per_day) + ' more')
 
-            cal_events_text += '</li>\n'
+            cal_events_text.append('</li>\n')
 
-        # Append the bottom and write the file
-        html_file = open(self.currPath + '/calendar.html', "w")
-        html_file.write(calendar_template.format(
-            month=month_name,
+        # Append the bottom
+        return load_template(self.get_template_path('calendar')).render(
+            month=escape(month_name),
             battText=batt_text,
-            dayOfWeek=cal_days_of_week,
-            events=cal_events_text
-        ))
-        html_file.close()
-
-        calendar_image = self.get_screenshot("calendar")
-        return calendar_image
+            dayOfWeek=''.join(cal_days_of_week),
+            events=''.join(cal_events_text)
+        )
 
     def generateDailyCal(self, current_date, current_weather, hourly_forecast, daily_forecast, weather_forecast_times, event_list, num_days_fetched, num_events_to_show, battery_status):
 
         # Insert battery icon
-        # batteryDisplayMode - 0: do not show / 1: always show / 2: show when battery is low
-        battery_display_mode = battery_status['batteryDisplayMode']
-        batt_level = battery_status['batteryLevel']
-
-        if battery_display_mode == 0:
-            batt_text = 'batteryHide'
-        elif battery_display_mode == 1:
-            if batt_level >= 80:
-                batt_text = 'battery80'
-            elif batt_level >= 60:
-                batt_text = 'battery60'
-            elif batt_level >= 40:
-                batt_text = 'battery40'
-            elif batt_level >= 20:
-                batt_text = 'battery20'
-            else:
-                batt_text = 'battery0'
-
-        elif battery_display_mode == 2 and batt_level < 20.0:
-            batt_text = 'battery0'
-        elif battery_display_mode == 2 and batt_level >= 20.0:
-            batt_text = 'batteryHide'
-
-        # Read html template
-        with open(self.currPath + '/dashboard_template.html', 'r') as file:
-            dashboard_template = file.read()
+        batt_text = self.get_battery_text(battery_status['batteryLevel'], battery_status['batteryDisplayMode'])
 
-        # Populate the date and eventss
+        # Pick the events to show, up to num_events_to_show across the days fetched
+        events_to_show = []
         events_marked_for_display = 0
-        cal_events_list = []
         for i in range(num_days_fetched):
-            cal_events_text = ""
-
-            for event in event_list[i]:
-                if events_marked_for_display >= num_events_to_show:
-                    break  # Stop adding events once limit is reached
-
-                cal_events_text += f"""
-                    <li class="event">
-                        <strong>{self.get_short_time(event['startDatetime'])} - {self.get_short_time(event['endDatetime'])} : {event['summary']}</strong><br>
-                        <span class="event-today">Location: {event['location']}</span><br>
-                        <span class="event-today">Notes: {event['description']}</span><br><br>
-                    </li>
-                """
-                events_marked_for_display += 1
-
-            cal_events_list.append(cal_events_text)
+            events_to_show.append(event_list[i][:num_events_to_show - events_marked_for_display])
+            events_marked_for_display += len(events_to_show[i])
 
             if events_marked_for_display >= num_events_to_show:
                 break  # Optionally stop processing more days as well
 
-        # Append the bottom and write the file
-        html_file = open(self.currPath + '/dashboard.html', "w")
-        html_file.write(dashboard_template.format(
+        fields = dict(
             day=current_date.strftime("%-d"),
             month=current_date.strftime("%B"),
             weekday=current_date.strftime("%A"),
-            events_today=cal_events_list[0],
             # I'm choosing to show the forecast for the next hour instead of the current weather
             current_weather_text=string.capwords(current_weather["weather"][0]["description"]),
             current_weather_id=current_weather["weather"][0]["id"],
             current_weather_temp=round((current_weather["temp"]* 9/5) + 32, 1),
             # current_weather_id=hourly_forecast[1]["weather"][0]["id"],
             # current_weather_temp=round(hourly_forecast[1]["temp"]),
-            hour0=weather_forecast_times[0],
-            hour0_weather_id=hourly_forecast[0]["weather"][0]["id"],
-            hour0_weather_pop=str(round(hourly_forecast[0]["pop"] * 100)),
-            hour0_weather_temp=str(round((hourly_forecast[0]["temp"]* 9/5) + 32, 1)),
-            hour1=weather_forecast_times[1],
-            hour1_weather_id=hourly_forecast[1]["weather"][0]["id"],
-            hour1_weather_pop=str(round(hourly_forecast[1]["pop"] * 100)),
-            hour1_weather_temp=str(round((hourly_forecast[1]["temp"]* 9/5) + 32, 1)),
-            hour2=weather_forecast_times[2],
-            hour2_weather_id=hourly_forecast[2]["weather"][0]["id"],
-            hour2_weather_pop=str(round(hourly_forecast[2]["pop"] * 100)),
-            hour2_weather_temp=str(round((hourly_forecast[2]["temp"]* 9/5) + 32, 1)),
-            hour3=weather_forecast_times[3],
-            hour3_weather_id=hourly_forecast[3]["weather"][0]["id"],
-            hour3_weather_pop=str(round(hourly_forecast[3]["pop"] * 100)),
-            hour3_weather_temp=str(round((hourly_forecast[3]["temp"]* 9/5) + 32, 1)),
-            hour4=weather_forecast_times[4],
-            hour4_weather_id=hourly_forecast[4]["weather"][0]["id"],
-            hour4_weather_pop=str(round(hourly_forecast[4]["pop"] * 100)),
-            hour4_weather_temp=str(round((hourly_forecast[4]["temp"]* 9/5) + 32, 1)),
-            hour5=weather_forecast_times[5],
-            hour5_weather_id=hourly_forecast[5]["weather"][0]["id"],
-            hour5_weather_pop=str(round(hourly_forecast[5]["pop"] * 100)),
-            hour5_weather_temp=str(round((hourly_forecast[5]["temp"]* 9/5) + 32, 1)),
             battText=batt_text,
-        ))
-        html_file.close()
-
-        calendar_image = self.get_screenshot("dashboard")
+        )
+        for i in range(6):
+            fields['hour{}'.format(i)] = weather_forecast_times[i]
+            fields['hour{}_weather_id'.format(i)] = hourly_forecast[i]["weather"][0]["id"]
+            fields['hour{}_weather_pop'.format(i)] = str(round(hourly_forecast[i]["pop"] * 100))
+            fields['hour{}_weather_temp'.format(i)] = str(round((hourly_forecast[i]["temp"]* 9/5) + 32, 1))
+
+        if self.backend == 'native':
+            calendar_image = self.nativeRenderer.draw_daily(fields, events_to_show[0], self.get_short_time)
+            return self.process_image(calendar_image)
+
+        dashboard_html = self.get_daily_html(fields, events_to_show[0])
+        calendar_image = self.get_screenshot(dashboard_html, "dashboard")
         return calendar_image
 
+    def get_daily_html(self, fields, events):
+        """
+        Returns the HTML of the day view. fields holds the values filled into the dashboard template and events the
+        list of events to show under "Upcoming Events".
+        """
+        cal_events_text = []
+        for event in events:
+            cal_events_text.append(f"""
+                    <li class="event">
+                        <strong>{self.get_short_time(event['startDatetime'])} - {self.get_short_time(event['endDatetime'])} : {escape(event['summary'])}</strong><br>
+                        <span class="event-today">Location: {escape(event['location'])}</span><br>
+                        <span class="event-today">Notes: {escape(event['description'])}</span><br><br>
+                    </li>
+                """)
+
+        # Append the bottom
+        return load_template(self.get_template_path('dashboard')).render(
+            events_today=''.join(cal_events_text),
+            **{name: escape(value) for name, value in fields.items()}
+        )
+
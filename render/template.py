@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This part of the code fills in the HTML templates in the "render" folder. A template is read and split into its literal
+text and its {placeholders} once, the first time it is used, so rendering a page only has to join the pieces with the
+values filled in. The templates keep the str.format syntax they have always used, {{ and }} standing for literal braces.
+"""
+
+import functools
+import html
+import os
+import string
+
+_templates = {}
+
+
+@functools.lru_cache(maxsize=4096)
+def escape(text):
+    # Escapes text taken from events or the weather, so that it shows as-is instead of being read as markup. Recurring
+    # events repeat the same summaries and locations all over the month, so the results are kept for reuse.
+    return html.escape(str(text))
+
+
+class Template:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'r') as file:
+            text = file.read()
+        self.mtime = os.path.getmtime(path)
+
+        # (literal text, placeholder name, format spec) for each placeholder, the last one without a placeholder
+        self.parts = []
+        for literal, name, spec, conversion in string.Formatter().parse(text):
+            if conversion:
+                raise ValueError('Conversions are not supported in templates: {{{}!{}}}'.format(name, conversion))
+            self.parts.append((literal, name, spec))
+        self.fields = {name for _, name, _ in self.parts if name is not None}
+
+    def render(self, **fields):
+        """
+        Returns the template with its placeholders replaced by the given values. The values are inserted as they are,
+        so text that is not markup has to go through escape() first.
+        """
+        missing = self.fields - set(fields)
+        if missing:
+            raise KeyError('Missing values for template {}: {}'.format(self.path, ', '.join(sorted(missing))))
+
+        out = []
+        for literal, name, spec in self.parts:
+            out.append(literal)
+            if name is not None:
+                out.append(format(fields[name], spec))
+        return ''.join(out)
+
+
+def load_template(path):
+    """
+    Returns the compiled template at path. Templates are compiled once per run and only read again if the file changes.
+    """
+    template = _templates.get(path)
+    if template is None or template.mtime != os.path.getmtime(path):
+        template = _templates[path] = Template(path)
+    return template